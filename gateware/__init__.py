@@ -1,10 +1,7 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
 # SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
-from subprocess import CalledProcessError
-from torii.build import Resource, Subsignal, Pins, Attrs
-from torii_boards.lattice.icebreaker import ICEBreakerPlatform
-from .swo import SWO
+from pathlib import Path
 
 __all__ = (
 	'cli',
@@ -12,10 +9,9 @@ __all__ = (
 
 def cli():
 	from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-	import logging
 
-	# Configure basic logging so it's ready to go from right at the start
-	configureLogging()
+	# Only argparse gets imported before the command line is parsed, so asking for help or getting the arguments
+	# wrong is quick. Each action then imports just what it needs to do its job
 
 	# Build the command line parser
 	parser = ArgumentParser(formatter_class = ArgumentDefaultsHelpFormatter,
@@ -24,14 +20,91 @@ def cli():
 
 	actions = parser.add_subparsers(dest = 'action', required = True)
 	buildAction = actions.add_parser('build', help = 'Build the SWO debug gateware')
-	actions.add_parser('sim', help = 'Simulate and test the gateware components')
+	simAction = actions.add_parser('sim', help = 'Simulate and test the gateware components')
+	compareAction = actions.add_parser('compare', help = 'Compare the last build against a baseline build summary')
+	diffAction = actions.add_parser('diff', help = 'Compare simulation VCDs against golden reference VCDs')
+	decodeAction = actions.add_parser('decode', help = 'Decode and check a logic analyser capture of the SWO output')
+	startupAction = actions.add_parser('startup', help = 'Check how quickly each action starts up against its budget')
+
+	# Allow the user to say where the summaries live and how much a build may change before it counts as a regression
+	compareAction.add_argument('--summary', type = Path, default = Path('build/swoDebug.summary.json'),
+		help = 'The build summary to check')
+	compareAction.add_argument('--baseline', type = Path, default = Path('build/swoDebug.baseline.json'),
+		help = 'The baseline build summary to compare against')
+	compareAction.add_argument('--update', action = 'store_true',
+		help = 'Store the build summary as the new baseline rather than comparing against it')
+	compareAction.add_argument('--area-tolerance', dest = 'areaTolerance', type = float, default = 0,
+		help = 'How much resource usage may grow by, in percent, before it is flagged')
+	compareAction.add_argument('--fmax-tolerance', dest = 'fmaxTolerance', type = float, default = 5,
+		help = 'How much Fmax may drop by, in percent, before it is flagged')
+
+	# Figure out which VCDs to compare, either a pair of files or a pair of directories to match up files between
+	diffAction.add_argument('golden', type = Path, help = 'The golden VCD, or a directory of golden VCDs')
+	diffAction.add_argument('current', type = Path, help = 'The VCD to check, or a directory of VCDs to check')
+	diffAction.add_argument('--signal', '-s', dest = 'signals', action = 'append', required = True,
+		help = 'A signal to compare, such as swo.o or encoder.manchesterOut (may be given multiple times)')
+
+	# Describe the capture to decode and how the SWO line was being driven
+	decodeAction.add_argument('capture', type = Path,
+		help = 'The capture to decode - a sigrok session (.sr), raw sigrok binary or a VCD')
+	decodeAction.add_argument('--format', choices = ('auto', 'session', 'binary', 'vcd'), default = 'auto',
+		help = 'What format the capture is in, by default worked out from the file')
+	decodeAction.add_argument('--channel', type = int, default = None,
+		help = 'Which logic analyser channel SWO was captured on (default is the probe named SWO, or channel 0)')
+	decodeAction.add_argument('--signal', default = 'swo.o', help = 'Which signal in a VCD capture is the SWO line')
+	decodeAction.add_argument('--samplerate', type = samplerate, default = None,
+		help = 'Sample rate of a raw binary capture, eg 24MHz')
+	decodeAction.add_argument('--unit-size', dest = 'unitSize', type = int, default = 1,
+		help = 'Bytes per sample in a raw binary capture')
+	decodeAction.add_argument('--stimulus', type = Path, default = None,
+		help = 'The ITM trace the gateware was built with, if not the default stimulus')
+	decodeAction.add_argument('--baud', type = float, default = 115200, help = 'Expected SWO baud rate')
+	decodeAction.add_argument('--chunk-size', dest = 'chunkSize', type = int, default = 2 ** 24,
+		help = 'How many samples to process at a time')
+
+	# Allow the user to trade how long the startup benchmark takes against how noisy it is
+	startupAction.add_argument('--runs', type = int, default = 5,
+		help = 'How many times to run each command line, taking the quickest')
+
+	# Allow the user to find out which FSM states and transitions the simulations reach
+	simAction.add_argument('--coverage', action = 'store_true',
+		help = 'Collect FSM state and transition coverage from the simulations')
 
 	# Allow the user to pick a seed if their toolchain is not giving good nextpnr runs
 	buildAction.add_argument('--seed', action = 'store', type = int, default = 0,
 		help = 'The nextpnr seed to use for the gateware build (default 0)')
+	# Or to have a whole range of seeds tried, keeping whichever gives the best timing
+	buildAction.add_argument('--seeds', action = 'store', type = seedRange, default = None,
+		help = 'A range of nextpnr seeds (A-B, or a comma separated list) to try, keeping the best result')
+	buildAction.add_argument('--jobs', '-j', action = 'store', type = int, default = None,
+		help = 'How many seeds or variants to build in parallel (default is the number of CPUs)')
+	# Allow the user to send their own ITM trace rather than the built in character stream
+	buildAction.add_argument('--stimulus', type = Path, default = None,
+		help = 'A file of ITM packets to have the gateware send instead of the default stimulus')
+	# Allow the user to run SWO at other speeds, and check it with the on-chip BER tester
+	buildAction.add_argument('--baud', type = int, default = 115200, help = 'The baud rate to run SWO at')
+	buildAction.add_argument('--loopback', choices = ('internal', 'external'), default = None,
+		help = 'Include the loopback BER tester, checking the SWO output either internally or via the loopback pin')
+	# Allow the user to have the output wrapped up in TPIU frames, interleaving several copies of the stimulus
+	buildAction.add_argument('--tpiu-sources', dest = 'tpiuSources', type = int, default = None,
+		help = 'Send the stimulus through a TPIU formatter from this many trace sources, each with its own ID')
+	buildAction.add_argument('--tpiu-switch', dest = 'tpiuSwitch', type = int, default = 16,
+		help = 'How many bytes each trace source sends before the TPIU formatter switches to the next')
+	# Allow the user to build a whole set of variants of the gateware in one go
+	buildAction.add_argument('--matrix', type = Path, default = None,
+		help = 'A TOML file describing variants of the gateware to build, instead of building just the one')
+	# Allow the user to get a per-module breakdown of resource usage in the build summary. This needs a second,
+	# hierarchy preserving, synthesis run which takes about as long again as the main one, so is off by default
+	buildAction.add_argument('--module-stats', dest = 'moduleStats', action = 'store_true',
+		help = 'Also report resource usage per module, at the cost of a second synthesis run (about doubles its time)')
+	# Allow the user to force the whole toolchain to be re-run
+	buildAction.add_argument('--no-cache', dest = 'noCache', action = 'store_true',
+		help = 'Ignore any cached synthesis and place-and-route results')
 
-	# Parse the command line and, if `-v` is specified, bump up the logging level
+	# Parse the command line, then configure logging and, if `-v` is specified, bump up the logging level
 	args = parser.parse_args()
+	import logging
+	configureLogging()
 	if args.verbose:
 		from logging import root, DEBUG
 		root.setLevel(DEBUG)
@@ -41,31 +114,122 @@ def cli():
 		from unittest.loader import TestLoader
 		from unittest.runner import TextTestRunner
 
+		if args.coverage:
+			from os import environ
+			from shutil import rmtree
+			from .fsmCoverage import coverageEnvironment
+
+			# Clear out any stale coverage shards and point the simulations at where to put new ones
+			coverageDirectory = Path.cwd() / 'build' / 'coverage'
+			rmtree(coverageDirectory, ignore_errors = True)
+			environ[coverageEnvironment] = str(coverageDirectory)
+
 		loader = TestLoader()
 		tests = loader.discover(start_dir = 'gateware.sim', pattern = '*.py')
 
 		runner = TextTestRunner()
 		runner.run(tests)
+
+		if args.coverage:
+			reportCoverage(coverageDirectory)
 		return 0
 	elif args.action == 'build':
-		platform = ICEBreakerPlatform()
-		platform.add_resources([
-			Resource('swo', 0,
-				Subsignal('swo', Pins('46', dir = 'o'), Attrs(IO_STANDARD = 'SB_LVCMOS')),
-				Subsignal('trigger', Pins('44', dir = 'i'), Attrs(IO_STANDARD = 'SB_LVCMOS')),
+		from subprocess import CalledProcessError
+		from .buildCache import BuildCache, icestormStages
+		from .buildReport import statisticsStage, addStatisticsScript, writeSummary
+		from .platform import swoPlatform
+		from .stimulus import StimulusImage
+		from .swo import SWO, Loopback
+
+		if args.matrix is not None:
+			return buildVariantMatrix(args.matrix, args.jobs, not args.noCache, args.moduleStats)
+
+		stimulus = None
+		if args.stimulus is not None:
+			try:
+				stimulus = StimulusImage.fromFile(args.stimulus, Path('build/cache/stimulus'))
+			except (OSError, ValueError) as error:
+				logging.error(f'Cannot use {args.stimulus} as stimulus: {error}')
+				return 1
+			logging.info(
+				f'Using {len(stimulus.packets)} ITM packets ({len(stimulus.data)} bytes, {stimulus.blocks} EBR blocks) '
+				f'from {args.stimulus}'
 			)
-		])
+
+		tpiu = None
+		if args.tpiuSources is not None:
+			from .tpiu import TPIUFormatter
+
+			if args.loopback is not None:
+				logging.error('The loopback BER tester cannot be used with the TPIU formatter')
+				return 1
+			sourceImage = stimulus if stimulus is not None else StimulusImage.default()
+			try:
+				tpiu = TPIUFormatter((sourceImage, ) * args.tpiuSources, args.tpiuSwitch)
+			except ValueError as error:
+				logging.error(f'Cannot build the TPIU formatter: {error}')
+				return 1
+			logging.info(f'Interleaving {args.tpiuSources} TPIU trace sources, {args.tpiuSwitch} bytes at a time')
+
+		platform = swoPlatform()
 		try:
-			nextpnrOptions = ['--tmg-ripup', f'--seed={args.seed}', '--write', 'swoDebug.pnr.json']
-			platform.build(SWO(), name = 'swoDebug', synth_opts = '-abc9', nextpnr_opts = nextpnrOptions)
+			nextpnrOptions = [
+				'--tmg-ripup', f'--seed={args.seed}', '--write', 'swoDebug.pnr.json', '--report', 'swoDebug.report.json'
+			]
+			loopback = Loopback(args.loopback) if args.loopback is not None else None
+			design = SWO(stimulus, args.baud, loopback, tpiu = tpiu)
+			plan = platform.prepare(design, name = 'swoDebug', synth_opts = '-abc9', nextpnr_opts = nextpnrOptions)
+			stages = icestormStages
+			if args.moduleStats:
+				addStatisticsScript(plan, 'swoDebug')
+				stages = (*icestormStages, statisticsStage)
+			cache = BuildCache(plan, 'swoDebug', stages = stages)
+			if args.seeds is not None:
+				result = buildSeeds(cache, args.seeds, args.jobs, not args.noCache)
+				if result != 0:
+					return result
+				cache.execute(useCache = not args.noCache, stages = ('statistics', ))
+			else:
+				cache.execute(useCache = not args.noCache)
+			# Don't let the per-module breakdown from an earlier build end up in this one's summary
+			if not args.moduleStats:
+				(cache.buildDir / 'swoDebug.stat.json').unlink(missing_ok = True)
 		except CalledProcessError:
 			logging.error('Synthesising gateware and building bitstream failed, see build logs for details')
 			return 1
+
+		# Summarise how the build went and keep a machine-readable copy for `compare`
+		summary = writeSummary(cache.buildDir, 'swoDebug')
+		for clock, timing in summary['fmax'].items():
+			logging.info(
+				f'{clock}: {timing["achieved"]:.2f} MHz achieved against {timing["constraint"]:.2f} MHz '
+				f'({timing["slack"]:.2f} ns slack)'
+			)
+		for resource in ('ICESTORM_LC', 'ICESTORM_RAM'):
+			usage = summary['utilisation'][resource]
+			logging.info(f'{resource}: {usage["used"]}/{usage["available"]} used')
 		return 0
+	elif args.action == 'compare':
+		return compareBuild(args.summary, args.baseline, args.update, args.areaTolerance, args.fmaxTolerance)
+	elif args.action == 'diff':
+		return compareVCDs(args.golden, args.current, args.signals)
+	elif args.action == 'decode':
+		return decodeCaptureFile(args)
+	elif args.action == 'startup':
+		return checkStartupTime(args.runs)
 
 	logging.error("Unknown action requested")
 	return 2
 
+# Command line argument types, which put off importing the modules they come from until they're used
+def seedRange(value: str) -> list[int]:
+	from .seedSweep import parseSeeds
+	return parseSeeds(value)
+
+def samplerate(value: str) -> float:
+	from .captureDecoder import parseSamplerate
+	return parseSamplerate(value)
+
 def configureLogging():
 	from rich.logging import RichHandler
 	import logging
@@ -76,3 +240,317 @@ def configureLogging():
 		level = logging.INFO,
 		handlers = [RichHandler(rich_tracebacks = True, show_path = False)]
 	)
+
+def buildSeeds(cache, seeds: list[int], jobs: int | None, useCache: bool):
+	from shutil import copy2
+	from rich.console import Console
+	from rich.table import Table
+	from .seedSweep import sweepSeeds, bestSeed
+	import logging
+
+	results = sweepSeeds(cache, seeds, jobs, useCache)
+	best = bestSeed(results)
+
+	# Display how each seed did
+	table = Table(title = 'nextpnr seed sweep')
+	table.add_column('Seed', justify = 'right')
+	table.add_column('Fmax (MHz)', justify = 'right')
+	table.add_column('Target (MHz)', justify = 'right')
+	table.add_column('Slack (ns)', justify = 'right')
+	table.add_column('Result')
+	for result in results:
+		if result.error is not None:
+			table.add_row(str(result.seed), '-', '-', '-', f'[red]{result.error}[/red]')
+			continue
+		status = 'cached' if result.cached else 'built'
+		if result is best:
+			status = f'[green]{status}, selected[/green]'
+		table.add_row(
+			str(result.seed), f'{result.fmax:.2f}', f'{result.constraint:.2f}', f'{result.slack:.2f}', status
+		)
+	Console().print(table)
+
+	if best is None:
+		logging.error('Place-and-route failed for every seed, see build logs for details')
+		return 1
+	# Copy the winning run's results up into the main build directory
+	for stage in cache.stages:
+		if stage.name not in ('place-and-route', 'bitstream'):
+			continue
+		for output in cache.stageOutputs(stage):
+			copy2(best.buildDir / output, cache.buildDir / output)
+	logging.info(f'Using seed {best.seed} at {best.fmax:.2f} MHz ({best.slack:.2f} ns slack)')
+	return 0
+
+def buildVariantMatrix(matrixFile: Path, jobs: int | None, useCache: bool, moduleStats: bool):
+	from json import dump
+	from shutil import copy2
+	from rich.console import Console
+	from rich.table import Table
+	from torii.build import ResourceError
+	from .buildMatrix import VariantResult, loadMatrix, prepareVariant, buildVariants
+	from .buildReport import writeSummary
+	from .platform import swoPlatform
+	import logging
+
+	try:
+		variants = loadMatrix(matrixFile)
+	except (OSError, ValueError, ResourceError) as error:
+		logging.error(f'Cannot load build matrix: {error}')
+		return 1
+
+	# Elaborate every variant up front, then hand the toolchain runs off to the process pool. Any that can't be
+	# elaborated are reported along with the rest, and don't stop the others being built
+	buildDir = Path('build').resolve()
+	builds = []
+	unbuildable = []
+	for variant in variants:
+		try:
+			cache = prepareVariant(
+				variant, swoPlatform(variant.swoPin, variant.triggerPin), buildDir, moduleStatistics = moduleStats
+			)
+		except (OSError, ValueError, ResourceError) as error:
+			logging.error(f'Cannot elaborate variant {variant.name}: {error}')
+			unbuildable.append(VariantResult(variant, buildDir / 'variants' / variant.name, error = 'elaboration failed'))
+			continue
+		builds.append((variant, cache))
+	logging.info(f'Building {len(builds)} variants from {matrixFile}')
+	results = buildVariants(builds, jobs, useCache) if builds else []
+	results = sorted(results + unbuildable, key = lambda result: variants.index(result.variant))
+
+	table = Table(title = f'Build matrix {matrixFile}')
+	table.add_column('Variant')
+	table.add_column('Baud', justify = 'right')
+	table.add_column('Mode')
+	table.add_column('Pins')
+	table.add_column('Fmax (MHz)', justify = 'right')
+	table.add_column('LCs', justify = 'right')
+	table.add_column('Result')
+	summaries = {}
+	for result in results:
+		variant = result.variant
+		pins = f'{variant.swoPin}/{variant.triggerPin}'
+		if result.error is not None:
+			table.add_row(variant.name, str(variant.baudRate), variant.mode.name, pins, '-', '-', f'[red]{result.error}[/red]')
+			continue
+		# Put the bitstream for each variant up in the main build directory under the variant's name
+		bitstream = f'swoDebug-{variant.name}.bin'
+		copy2(result.buildDir / 'swoDebug.bin', buildDir / bitstream)
+		summary = writeSummary(result.buildDir, 'swoDebug')
+		summaries[variant.name] = {'variant': variant.parameters(), 'bitstream': bitstream, **summary}
+
+		fmax = min(timing['achieved'] for timing in summary['fmax'].values())
+		status = 'cached' if result.cached else 'built'
+		if result.sharedWith is not None:
+			status += f', netlist shared with {result.sharedWith}'
+		table.add_row(
+			variant.name, str(variant.baudRate), variant.mode.name, pins, f'{fmax:.2f}',
+			str(summary['utilisation']['ICESTORM_LC']['used']), status
+		)
+	Console().print(table)
+
+	with (buildDir / 'swoDebug.matrix.json').open('w') as file:
+		dump(summaries, file, indent = '\t')
+	failures = [result for result in results if result.error is not None]
+	if failures:
+		logging.error(f'{len(failures)} of {len(results)} variants failed to build, see their build logs for details')
+		return 1
+	return 0
+
+def compareBuild(summaryFile: Path, baselineFile: Path, update: bool, areaTolerance: float, fmaxTolerance: float):
+	from shutil import copy2
+	from rich.console import Console
+	from rich.table import Table
+	from .buildReport import loadSummary, compareSummaries
+	import logging
+
+	if not summaryFile.exists():
+		logging.error(f'Build summary {summaryFile} does not exist, run a build first')
+		return 1
+	if update:
+		copy2(summaryFile, baselineFile)
+		logging.info(f'Stored {summaryFile} as the new baseline')
+		return 0
+	if not baselineFile.exists():
+		logging.error(f'Baseline {baselineFile} does not exist, store one with `compare --update`')
+		return 1
+
+	changes = compareSummaries(
+		loadSummary(baselineFile), loadSummary(summaryFile),
+		areaTolerance = areaTolerance, fmaxTolerance = fmaxTolerance
+	)
+	if not changes:
+		logging.info('Build matches the baseline')
+		return 0
+
+	table = Table(title = f'Changes against {baselineFile}')
+	table.add_column('Metric')
+	table.add_column('Baseline', justify = 'right')
+	table.add_column('Current', justify = 'right')
+	table.add_column('Change', justify = 'right')
+	for change in changes:
+		formatValue = lambda value: '-' if value is None else f'{value:g}'
+		percent = '-' if change.change is None else f'{change.change:+.1f}%'
+		style = 'red' if change.regression else 'green'
+		table.add_row(
+			change.metric, formatValue(change.baseline), formatValue(change.current), f'[{style}]{percent}[/{style}]'
+		)
+	Console().print(table)
+
+	regressions = [change for change in changes if change.regression]
+	if regressions:
+		logging.error(f'{len(regressions)} regressions against the baseline')
+		return 1
+	return 0
+
+def reportCoverage(coverageDirectory: Path):
+	from .fsmCoverage import FSMCoverage
+	import logging
+
+	# Merge the shards from every simulation process and store the combined result alongside them
+	coverage = FSMCoverage.fromShards(coverageDirectory)
+	coverage.save(coverageDirectory / 'fsmCoverage.json')
+	for line in coverage.report():
+		logging.info(line)
+
+def compareVCDs(golden: Path, current: Path, signals: list[str]):
+	from .vcd import VCDFile, diffVCDs
+	import logging
+
+	# If we were given directories, pair up the VCDs by name
+	if golden.is_dir():
+		pairs = [(goldenFile, current / goldenFile.name) for goldenFile in sorted(golden.glob('*.vcd'))]
+	else:
+		pairs = [(golden, current)]
+
+	divergent = False
+	for goldenFile, currentFile in pairs:
+		if not currentFile.exists():
+			logging.error(f'{currentFile} does not exist to compare against {goldenFile}')
+			divergent = True
+			continue
+
+		# Files that can't be read and signals that can't be found or are ambiguous are reported against the pair
+		try:
+			with VCDFile(goldenFile) as goldenVCD, VCDFile(currentFile) as currentVCD:
+				# When comparing whole directories, not every test bench has every signal, so skip the missing ones
+				fileSignals = [signal for signal in signals if signal in goldenVCD or len(pairs) == 1]
+				if not fileSignals:
+					logging.debug(f'{goldenFile.name}: none of the requested signals are present, skipping')
+					continue
+				results = diffVCDs(goldenVCD, currentVCD, fileSignals)
+		except (OSError, KeyError, ValueError) as error:
+			logging.error(f'{goldenFile.name}: {error}')
+			divergent = True
+			continue
+
+		divergences = sorted(
+			(result for result in results.values() if result is not None), key = lambda result: result.time
+		)
+		if not divergences:
+			logging.info(f'{goldenFile.name}: matches on {", ".join(fileSignals)}')
+			continue
+
+		divergent = True
+		first = divergences[0]
+		logging.error(
+			f'{goldenFile.name}: first divergence at cycle {first.cycle} on {first.signal} '
+			f'(golden {first.golden}, current {first.current})'
+		)
+		for result in divergences[1:]:
+			logging.info(f'  {result.signal} diverges from cycle {result.cycle}')
+	return 1 if divergent else 0
+
+def checkStartupTime(runs: int):
+	from rich.console import Console
+	from rich.table import Table
+	from .startupTime import startupBudgets, profileStartup
+	import logging
+
+	table = Table(title = 'Command line startup')
+	table.add_column('Command line')
+	table.add_column('Imports (ms)', justify = 'right')
+	table.add_column('Budget (ms)', justify = 'right')
+	table.add_column('Result')
+	failures = 0
+	for budget in startupBudgets:
+		profile = profileStartup(budget.arguments, runs)
+		problems = [f'imports {package}' for package in budget.forbidden if profile.imported(package)]
+		if profile.importTime > budget.budget:
+			problems.append('over budget')
+		result = '[green]OK[/green]' if not problems else f'[red]{", ".join(problems)}[/red]'
+		failures += 1 if problems else 0
+		table.add_row(' '.join(budget.arguments), f'{profile.importTime:.1f}', f'{budget.budget:.0f}', result)
+	Console().print(table)
+
+	if failures:
+		logging.error(f'{failures} command lines failed their startup budget')
+		return 1
+	return 0
+
+def decodeCaptureFile(args):
+	from zipfile import is_zipfile
+	from rich.console import Console
+	from rich.table import Table
+	from .captureDecoder import (
+		decodeCapture, sampleRuns, sigrokBinaryChunks, sigrokSessionChunks, vcdRuns
+	)
+	from .stimulus import StimulusImage
+	from .vcd import VCDFile
+	import logging
+
+	capture: Path = args.capture
+	if not capture.is_file():
+		logging.error(f'Capture {capture} does not exist')
+		return 1
+	captureFormat = args.format
+	if captureFormat == 'auto':
+		if capture.suffix == '.vcd':
+			captureFormat = 'vcd'
+		elif is_zipfile(capture):
+			captureFormat = 'session'
+		else:
+			captureFormat = 'binary'
+
+	try:
+		stimulus = StimulusImage.default() if args.stimulus is None else StimulusImage.fromFile(args.stimulus)
+	except (OSError, ValueError) as error:
+		logging.error(f'Cannot use {args.stimulus} as stimulus: {error}')
+		return 1
+	expected = stimulus.packetData()
+	if captureFormat == 'vcd':
+		with VCDFile(capture) as vcd:
+			sampleRate, runs = vcdRuns(vcd, args.signal, args.chunkSize)
+			report = decodeCapture(runs, sampleRate, args.baud, expected)
+	else:
+		if captureFormat == 'session':
+			sampleRate, chunks = sigrokSessionChunks(capture, args.channel, args.chunkSize)
+		else:
+			if args.samplerate is None:
+				logging.error('The sample rate of raw binary captures must be given with --samplerate')
+				return 1
+			sampleRate = args.samplerate
+			chunks = sigrokBinaryChunks(capture, args.channel or 0, args.unitSize, args.chunkSize)
+		report = decodeCapture(sampleRuns(chunks), sampleRate, args.baud, expected)
+
+	table = Table(title = f'ITM packets in {capture.name}')
+	table.add_column('Packet')
+	table.add_column('Count', justify = 'right')
+	for kind, count in sorted(report.packets.items(), key = lambda item: item[0].value):
+		table.add_row(kind.value, str(count))
+	for port, count in sorted(report.ports.items()):
+		table.add_row(f'  stimulus port {port}', str(count))
+	Console().print(table)
+
+	logging.info(f'{report.frames} frames decoded')
+	if report.baudRate is not None:
+		deviation = ((report.baudRate - args.baud) / args.baud) * 100
+		logging.info(f'Measured baud rate {report.baudRate:.0f} ({deviation:+.2f}% from {args.baud:.0f})')
+	if report.unsynchronisedFrames:
+		logging.warning(f'{report.unsynchronisedFrames} frames before the ITM stimulus stream could be matched')
+	logging.log(
+		logging.ERROR if report.errors else logging.INFO,
+		f'{report.violations} code violations, {report.framingErrors} framing errors, '
+		f'{report.bitErrors} bit errors, {report.missingFrames} missing frames'
+	)
+	return 1 if report.errors else 0
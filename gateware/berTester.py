@@ -0,0 +1,152 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from torii import Elaboratable, Module, Signal, Array
+from torii.build import Platform
+from torii.lib.io import Pin
+from torii.lib.stdio.serial import AsyncSerial
+from .manchester import ManchesterDecoder
+
+__all__ = (
+	'BERTester',
+	'RegisterReadout',
+)
+
+class BERTester(Elaboratable):
+	'''
+	Loopback bit error rate tester.
+
+	Decodes the Manchester-coded SWO line and compares each byte received against what the stimulus ROM
+	says should have been sent. When a frame starts, the expected data is lined up with the ROM entry of the
+	frame the SWO block is currently sending, so a lost or mangled frame does not throw off the frames after it.
+	Errors are only counted once a good frame has been seen, so starting up part way through a frame is fine.
+	'''
+
+	def __init__(self, depth: int, baudRate: int = 115200) -> None:
+		self.baudRate = baudRate
+
+		# Manchester coded data stream to check, and whether to check it at all
+		self.lineIn = Signal()
+		self.enable = Signal()
+		# Pulse to clear the counters down
+		self.clear = Signal()
+
+		# ROM entry of the start of the frame being sent, and the port for reading the expected data
+		self.frameEntry = Signal(range(depth))
+		self.expectedEntry = Signal(range(depth))
+		self.expectedData = Signal(8)
+		self.depth = depth
+
+		# Counters for the number of good frames and bits checked, and the number of bad bits and frames
+		self.frames = Signal(32)
+		self.bitsChecked = Signal(32)
+		self.bitErrors = Signal(32)
+		self.frameErrors = Signal(32)
+		# Status signals for whether we've synchronised with the stream and if there have been any errors
+		self.locked = Signal()
+		self.errors = Signal()
+
+	def elaborate(self, platform: Platform) -> Module:
+		m = Module()
+
+		m.submodules.decoder = decoder = ManchesterDecoder(self.baudRate)
+		m.d.comb += decoder.manchesterIn.eq(self.lineIn)
+
+		# When a frame starts, line the expected data up with the frame that's being sent
+		with m.If(decoder.frameStart):
+			m.d.sync += self.expectedEntry.eq(self.frameEntry)
+
+		# Compare each byte as it arrives, counting how many bits differ, then step to the next expected byte
+		difference = decoder.data ^ self.expectedData
+		differingBits = sum(difference[bit] for bit in range(8))
+		with m.If(decoder.dataValid):
+			with m.If(self.expectedEntry == self.depth - 1):
+				m.d.sync += self.expectedEntry.eq(0)
+			with m.Else():
+				m.d.sync += self.expectedEntry.eq(self.expectedEntry + 1)
+			with m.If(self.locked):
+				m.d.sync += [
+					self.bitsChecked.eq(self.bitsChecked + 8),
+					self.bitErrors.eq(self.bitErrors + differingBits),
+				]
+				with m.If(difference != 0):
+					m.d.sync += self.errors.eq(1)
+
+		with m.If(decoder.frameEnd):
+			m.d.sync += self.locked.eq(1)
+			with m.If(self.locked):
+				m.d.sync += self.frames.eq(self.frames + 1)
+		# The rest of a mangled frame can look like the start of another, so drop the lock on an error and only
+		# pick back up again after the next good frame, so one bad frame counts as one frame error
+		with m.If(decoder.frameError & self.locked):
+			m.d.sync += [
+				self.frameErrors.eq(self.frameErrors + 1),
+				self.errors.eq(1),
+				self.locked.eq(0),
+			]
+
+		# Clearing, or not checking, drops the counters and lock - the latter so we resynchronise on re-enable
+		with m.If(self.clear | ~self.enable):
+			m.d.sync += [
+				self.frames.eq(0),
+				self.bitsChecked.eq(0),
+				self.bitErrors.eq(0),
+				self.frameErrors.eq(0),
+				self.errors.eq(0),
+			]
+		with m.If(~self.enable):
+			m.d.sync += self.locked.eq(0)
+
+		return m
+
+class RegisterReadout(Elaboratable):
+	'''
+	Makes a set of 32-bit registers readable over a UART.
+
+	Sending a register number gets the register's value back as 4 bytes, least significant first. Sending a
+	byte with bit 7 set pulses `clear` instead.
+	'''
+
+	def __init__(self, registers: tuple[Signal, ...], divisor: int, pins: Pin | None = None) -> None:
+		self.registers = registers
+		self.serial = AsyncSerial(divisor = divisor, pins = pins)
+		self.clear = Signal()
+
+	def elaborate(self, platform: Platform) -> Module:
+		m = Module()
+		m.submodules.serial = serial = self.serial
+
+		registers = Array(self.registers)
+		value = Signal(32)
+		byte = Signal(range(4))
+
+		# Always accept commands, any that arrive while we're still replying to the last are dropped
+		m.d.comb += serial.rx.ack.eq(1)
+
+		with m.FSM(name = 'readout'):
+			with m.State('IDLE'):
+				with m.If(serial.rx.rdy):
+					command = serial.rx.data
+					with m.If(command[7]):
+						m.d.comb += self.clear.eq(1)
+					with m.Elif(command < len(self.registers)):
+						# Take a snapshot of the register so the value we send is self-consistent
+						m.d.sync += [
+							value.eq(registers[command[0:7]]),
+							byte.eq(0),
+						]
+						m.next = 'REPLY'
+			with m.State('REPLY'):
+				m.d.comb += [
+					serial.tx.data.eq(value[0:8]),
+					serial.tx.ack.eq(1),
+				]
+				with m.If(serial.tx.rdy):
+					m.d.sync += [
+						value.eq(value >> 8),
+						byte.eq(byte + 1),
+					]
+					with m.If(byte == 3):
+						m.next = 'IDLE'
+
+		return m
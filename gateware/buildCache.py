@@ -0,0 +1,186 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from dataclasses import dataclass
+from hashlib import blake2b
+from os import environ, getpid
+from pathlib import Path
+from shlex import split
+from shutil import copy2, rmtree
+from subprocess import run, check_call, DEVNULL
+from typing import TYPE_CHECKING
+import logging
+
+# Torii is only needed once a build is actually being done, so don't pay for importing it just to get at the stages
+if TYPE_CHECKING:
+	from torii.build.run import BuildPlan
+
+__all__ = (
+	'BuildCache',
+	'BuildStage',
+	'icestormStages',
+)
+
+@dataclass(frozen = True)
+class BuildStage:
+	name: str
+	# Tool that the build script invokes for this stage
+	tool: str
+	# Build plan files that feed into this stage (besides the outputs of the previous stages)
+	inputs: tuple[str, ...]
+	# Files produced by the stage that must be kept in the cache
+	outputs: tuple[str, ...]
+	# Command line options for the tool that name additional files it writes out
+	outputOptions: tuple[str, ...] = ()
+	# Command line option that makes the tool report its version, if it has one
+	versionOption: str | None = None
+	# Command to run for stages that are not part of the generated build script, templated on the design name
+	command: str | None = None
+	# Whether the stage depends on the results of the stages before it
+	chained: bool = True
+
+# The Yosys -> nextpnr -> icepack flow used for the iCE40 parts. Everything is a template on the design name
+icestormStages = (
+	BuildStage(
+		name = 'synthesis', tool = 'yosys', inputs = ('{name}.il', '{name}.ys'),
+		outputs = ('{name}.json', '{name}.rpt'), versionOption = '-V'
+	),
+	BuildStage(
+		name = 'place-and-route', tool = 'nextpnr-ice40', inputs = ('{name}.pcf', ),
+		outputs = ('{name}.asc', '{name}.tim'), outputOptions = ('--write', '--report'), versionOption = '--version'
+	),
+	BuildStage(
+		name = 'bitstream', tool = 'icepack', inputs = (), outputs = ('{name}.bin', )
+	),
+)
+
+class BuildCache:
+	'''
+	Content-addressed cache for the gateware build flow.
+
+	Rather than running the whole build script generated by Torii, each stage is run individually. A stage is
+	keyed on the key of the stage before it, its command line, the tool version and the contents of its input
+	files - so synthesis is keyed on the RTLIL and Yosys options, and place-and-route additionally on the pin
+	constraints and nextpnr options. On a hit, the stage's outputs are copied back out of the cache instead of
+	running the tool, which means changing just the nextpnr options goes straight to place-and-route.
+	'''
+
+	def __init__(
+		self, plan: 'BuildPlan', name: str, buildDir: Path = Path('build'), cacheDir: Path | None = None,
+		stages: tuple[BuildStage, ...] = icestormStages
+	) -> None:
+		from torii.tools import tool_env_var
+
+		self.plan = plan
+		self.name = name
+		self.buildDir = buildDir.resolve()
+		self.cacheDir = cacheDir.resolve() if cacheDir is not None else self.buildDir / 'cache'
+		self.stages = stages
+
+		# Split the generated build script into the environment setup and the per-tool commands
+		script = plan.files[f'{plan.script}.sh']
+		if isinstance(script, bytes):
+			script = script.decode('utf-8')
+		lines = script.splitlines()
+		self.prelude = [line for line in lines if not line.startswith('"$')]
+		self.commands: dict[str, str] = {}
+		for stage in stages:
+			if stage.command is not None:
+				self.commands[stage.name] = stage.command.format(name = name)
+				continue
+			invocation = f'"${tool_env_var(stage.tool)}"'
+			command = next((line for line in lines if line.startswith(invocation)), None)
+			if command is None:
+				raise ValueError(f'Build script for {name} does not run {stage.tool}')
+			self.commands[stage.name] = command
+
+	def variant(self, buildDir: Path, commands: dict[str, str]) -> 'BuildCache':
+		# Make a copy of this build that happens in a different directory with some of the stage commands replaced,
+		# sharing the cache so that anything in common between the two builds is only run once
+		variant = BuildCache(self.plan, self.name, buildDir, self.cacheDir, self.stages)
+		for stage, command in commands.items():
+			if stage not in variant.commands:
+				raise ValueError(f'Build has no stage named {stage}')
+			variant.commands[stage] = command
+		return variant
+
+	def command(self, stage: str) -> str:
+		return self.commands[stage]
+
+	def _toolVersion(self, stage: BuildStage) -> bytes:
+		from torii.tools import tool_env_var
+
+		if stage.versionOption is None:
+			return b''
+		tool = environ.get(tool_env_var(stage.tool), stage.tool)
+		try:
+			return run([tool, stage.versionOption], capture_output = True, stdin = DEVNULL).stdout
+		except OSError:
+			return b''
+
+	def stageOutputs(self, stage: BuildStage) -> list[str]:
+		outputs = [output.format(name = self.name) for output in stage.outputs]
+		# Pick up any extra files the command line asks the tool to write, such as nextpnr's `--write`
+		arguments = split(self.commands[stage.name])
+		for option, value in zip(arguments, arguments[1:]):
+			if option in stage.outputOptions:
+				outputs.append(value)
+		return outputs
+
+	def stageKey(self, stage: BuildStage, previousKey: str) -> str:
+		hasher = blake2b(digest_size = 32)
+		hasher.update(previousKey.encode('utf-8'))
+		hasher.update(self.commands[stage.name].encode('utf-8'))
+		hasher.update(self._toolVersion(stage))
+		for input in stage.inputs:
+			fileName = input.format(name = self.name)
+			content = self.plan.files[fileName]
+			if isinstance(content, str):
+				content = content.encode('utf-8')
+			hasher.update(fileName.encode('utf-8'))
+			hasher.update(content)
+		return hasher.hexdigest()
+
+	def _runStage(self, stage: BuildStage) -> None:
+		check_call(['sh', '-c', '\n'.join((*self.prelude, self.commands[stage.name]))], cwd = self.buildDir)
+
+	def execute(self, *, useCache: bool = True, stages: tuple[str, ...] | None = None) -> dict[str, bool]:
+		# Write out all the files from the plan, then work through the stages returning which were cache hits
+		self.plan.extract(self.buildDir)
+		hits: dict[str, bool] = {}
+		chainKey = ''
+		for stage in self.stages:
+			# Stages that stand alone are keyed only on their own inputs and do not feed into the chain
+			if stage.chained:
+				key = chainKey = self.stageKey(stage, chainKey)
+			else:
+				key = self.stageKey(stage, '')
+			# If only some of the stages are wanted, the keys for the rest must still be computed to chain correctly
+			if stages is not None and stage.name not in stages:
+				continue
+			entry = self.cacheDir / key
+			outputs = self.stageOutputs(stage)
+
+			if useCache and all((entry / output).is_file() for output in outputs):
+				logging.info(f'Using cached {stage.name} results ({key[:12]})')
+				for output in outputs:
+					copy2(entry / output, self.buildDir / output)
+				hits[stage.name] = True
+				continue
+
+			logging.info(f'Running {stage.name}')
+			self._runStage(stage)
+			hits[stage.name] = False
+			# Store the results away, going via a temporary directory so partial entries never look valid
+			partial = entry.with_name(f'{key}.{getpid()}.partial')
+			rmtree(partial, ignore_errors = True)
+			partial.mkdir(parents = True)
+			for output in outputs:
+				copy2(self.buildDir / output, partial / output)
+			rmtree(entry, ignore_errors = True)
+			try:
+				partial.rename(entry)
+			except OSError:
+				# Another build running in parallel stored the same results first, so just use theirs
+				rmtree(partial, ignore_errors = True)
+		return hits
@@ -0,0 +1,223 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from subprocess import CalledProcessError
+import re
+import tomllib
+from torii.build import Platform
+from .buildCache import BuildCache, icestormStages
+from .buildReport import statisticsStage, addStatisticsScript
+from .platform import reservedPins
+from .stimulus import StimulusImage
+from .swo import SWO, SWOMode, Loopback
+
+__all__ = (
+	'BuildVariant',
+	'VariantResult',
+	'loadMatrix',
+	'prepareVariant',
+	'buildVariants',
+)
+
+@dataclass(frozen = True)
+class BuildVariant:
+	name: str
+	baudRate: int = 115200
+	swoPin: str = '46'
+	triggerPin: str = '44'
+	mode: SWOMode = SWOMode.triggered
+	loopback: Loopback | None = None
+	stimulus: Path | None = None
+	seed: int = 0
+
+	# Parameters of the variant as they are written in the matrix file, for reporting
+	def parameters(self) -> dict[str, str | int]:
+		parameters = {
+			'baud': self.baudRate,
+			'swo-pin': self.swoPin,
+			'trigger-pin': self.triggerPin,
+			'mode': self.mode.name,
+			'seed': self.seed,
+		}
+		if self.loopback is not None:
+			parameters['loopback'] = self.loopback.value
+		if self.stimulus is not None:
+			parameters['stimulus'] = str(self.stimulus)
+		return parameters
+
+@dataclass(frozen = True)
+class VariantResult:
+	variant: BuildVariant
+	buildDir: Path
+	# Name of the variant whose synthesis results were reused, if the netlist was the same as an earlier one's
+	sharedWith: str | None = None
+	# Whether everything came from the cache
+	cached: bool = False
+	error: str | None = None
+
+# Map of the keys in a matrix file to the BuildVariant fields they set
+matrixKeys = {
+	'baud': 'baudRate',
+	'swo-pin': 'swoPin',
+	'trigger-pin': 'triggerPin',
+	'mode': 'mode',
+	'loopback': 'loopback',
+	'stimulus': 'stimulus',
+	'seed': 'seed',
+}
+
+def _variantField(fileName: Path, name: str, key: str, value) -> tuple[str, object]:
+	# Check and convert a single setting from the matrix file to the variant field and value it sets
+	if key not in matrixKeys:
+		raise ValueError(f'{fileName}: unknown setting \'{key}\' for variant {name}')
+	field = matrixKeys[key]
+	return field, _variantValue(fileName, name, key, field, value)
+
+def _variantValue(fileName: Path, name: str, key: str, field: str, value):
+	if field == 'baudRate' or field == 'seed':
+		if not isinstance(value, int) or isinstance(value, bool) or value < (1 if field == 'baudRate' else 0):
+			raise ValueError(f'{fileName}: {key} for variant {name} must be a positive integer, not {value!r}')
+		return value
+	if field == 'swoPin' or field == 'triggerPin':
+		if isinstance(value, int) and not isinstance(value, bool):
+			value = str(value)
+		if not isinstance(value, str):
+			raise ValueError(f'{fileName}: {key} for variant {name} must be a pin name, not {value!r}')
+		return value
+	if field == 'mode':
+		if value not in SWOMode.__members__:
+			modes = ', '.join(SWOMode.__members__)
+			raise ValueError(f'{fileName}: mode for variant {name} must be one of {modes}, not {value!r}')
+		return SWOMode[value]
+	if field == 'loopback':
+		try:
+			return Loopback(value)
+		except ValueError:
+			loopbacks = ', '.join(loopback.value for loopback in Loopback)
+			raise ValueError(f'{fileName}: loopback for variant {name} must be one of {loopbacks}, not {value!r}')
+	if not isinstance(value, str):
+		raise ValueError(f'{fileName}: stimulus for variant {name} must be a file name, not {value!r}')
+	# Stimulus files are relative to the matrix file
+	return fileName.parent / value
+
+def loadMatrix(fileName: Path) -> tuple[BuildVariant, ...]:
+	'''
+	Load a variant matrix. This is a TOML file with an optional `[defaults]` table of settings that apply to
+	every variant, and a `[[variant]]` table for each variant to build which must give it a name, eg:
+
+		[defaults]
+		mode = "continuous"
+
+		[[variant]]
+		name = "fast"
+		baud = 1000000
+		swo-pin = "45"
+	'''
+	with fileName.open('rb') as file:
+		try:
+			matrix = tomllib.load(file)
+		except tomllib.TOMLDecodeError as error:
+			raise ValueError(f'{fileName}: {error}')
+
+	unknown = matrix.keys() - {'defaults', 'variant'}
+	if unknown:
+		raise ValueError(f'{fileName}: unknown section \'{sorted(unknown)[0]}\'')
+	defaults = dict(
+		_variantField(fileName, 'defaults', key, value) for key, value in matrix.get('defaults', {}).items()
+	)
+
+	# Pins the other resources the design uses sit on, which the SWO and trigger pins can't be moved to
+	reserved = reservedPins()
+	variants: list[BuildVariant] = []
+	for entry in matrix.get('variant', []):
+		name = entry.get('name')
+		# Names end up in file names, so keep them to characters that are safe there
+		if not isinstance(name, str) or re.fullmatch(r'[\w.-]+', name) is None:
+			raise ValueError(f'{fileName}: variant name {name!r} is not valid, use letters, numbers, \'.\', \'_\' and \'-\'')
+		if any(variant.name == name for variant in variants):
+			raise ValueError(f'{fileName}: variant {name} is defined more than once')
+		settings = dict(_variantField(fileName, name, key, value) for key, value in entry.items() if key != 'name')
+		variant = BuildVariant(name, **{**defaults, **settings})
+		if variant.swoPin == variant.triggerPin:
+			raise ValueError(f'{fileName}: variant {name} puts SWO and the trigger on the same pin')
+		for key, pin in (('swo-pin', variant.swoPin), ('trigger-pin', variant.triggerPin)):
+			if pin in reserved:
+				raise ValueError(f'{fileName}: {key} for variant {name} is pin {pin}, which {reserved[pin]} already uses')
+		variants.append(variant)
+
+	if not variants:
+		raise ValueError(f'{fileName}: no variants defined')
+	return tuple(variants)
+
+def prepareVariant(
+	variant: BuildVariant, platform: Platform, buildDir: Path, name: str = 'swoDebug', moduleStatistics: bool = False
+) -> BuildCache:
+	# Elaborate the variant and lay its build out in a directory of its own. Every variant is built under the same
+	# design name and shares the one cache, so any that synthesise to the same netlist share synthesis results
+	stimulus = None
+	if variant.stimulus is not None:
+		stimulus = StimulusImage.fromFile(variant.stimulus, buildDir / 'cache' / 'stimulus')
+	design = SWO(stimulus, variant.baudRate, variant.loopback, variant.mode)
+	nextpnrOptions = [
+		'--tmg-ripup', f'--seed={variant.seed}', '--write', f'{name}.pnr.json', '--report', f'{name}.report.json'
+	]
+	plan = platform.prepare(design, name = name, synth_opts = '-abc9', nextpnr_opts = nextpnrOptions)
+	stages = icestormStages
+	# The per-module breakdown needs a second synthesis run, so is only done when asked for
+	if moduleStatistics:
+		addStatisticsScript(plan, name)
+		stages = (*icestormStages, statisticsStage)
+	variantDir = buildDir / 'variants' / variant.name
+	# Don't let the per-module breakdown from an earlier build end up in this one's summary
+	(variantDir / f'{name}.stat.json').unlink(missing_ok = True)
+	return BuildCache(plan, name, variantDir, buildDir / 'cache', stages = stages)
+
+def _synthesise(cache: BuildCache, useCache: bool) -> tuple[bool, str | None]:
+	try:
+		hits = cache.execute(useCache = useCache, stages = ('synthesis', 'statistics'))
+	except CalledProcessError as error:
+		return False, f'synthesis exited with status {error.returncode}'
+	return all(hits.values()), None
+
+def _placeAndRoute(cache: BuildCache, useCache: bool) -> tuple[bool, str | None]:
+	try:
+		# Synthesis has been run by the time we get here, so always take it from the cache
+		cache.execute(stages = ('synthesis', 'statistics'))
+		hits = cache.execute(useCache = useCache, stages = ('place-and-route', 'bitstream'))
+	except CalledProcessError as error:
+		return False, f'toolchain exited with status {error.returncode}'
+	return all(hits.values()), None
+
+def buildVariants(
+	builds: list[tuple[BuildVariant, BuildCache]], jobs: int | None, useCache: bool = True
+) -> list[VariantResult]:
+	# Work out which variants synthesise to the same netlist, so that each distinct netlist is only synthesised once
+	synthesis = next(stage for stage in builds[0][1].stages if stage.name == 'synthesis')
+	keys = [cache.stageKey(synthesis, '') for _, cache in builds]
+	netlists: dict[str, tuple[BuildVariant, BuildCache]] = {}
+	for key, build in zip(keys, builds):
+		netlists.setdefault(key, build)
+
+	with ProcessPoolExecutor(max_workers = jobs) as pool:
+		synthesised = {key: pool.submit(_synthesise, cache, useCache) for key, (_, cache) in netlists.items()}
+		synthesised = {key: future.result() for key, future in synthesised.items()}
+		# Then place-and-route every variant whose netlist synthesised, all in parallel
+		placed = {
+			variant.name: pool.submit(_placeAndRoute, cache, useCache)
+			for key, (variant, cache) in zip(keys, builds) if synthesised[key][1] is None
+		}
+
+		results: list[VariantResult] = []
+		for key, (variant, cache) in zip(keys, builds):
+			owner = netlists[key][0]
+			sharedWith = owner.name if owner is not variant else None
+			synthesisCached, error = synthesised[key]
+			if error is not None:
+				results.append(VariantResult(variant, cache.buildDir, sharedWith, error = error))
+				continue
+			placeCached, error = placed[variant.name].result()
+			results.append(VariantResult(variant, cache.buildDir, sharedWith, synthesisCached and placeCached, error))
+		return results
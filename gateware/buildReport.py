@@ -0,0 +1,161 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from dataclasses import dataclass
+from json import dump, load
+from pathlib import Path
+from typing import TYPE_CHECKING
+import re
+from .buildCache import BuildStage
+
+# Comparing build summaries doesn't need Torii, so only import it for type checking
+if TYPE_CHECKING:
+	from torii.build.run import BuildPlan
+
+__all__ = (
+	'statisticsStage',
+	'addStatisticsScript',
+	'buildSummary',
+	'writeSummary',
+	'loadSummary',
+	'SummaryChange',
+	'compareSummaries',
+)
+
+# Yosys flattens the design during synthesis, so to get a per-module breakdown we run a second, hierarchy
+# preserving, synthesis alongside the main one. It only depends on the RTLIL so is not chained on the other stages.
+# This about doubles how long synthesis takes, so it is only run when asked for.
+statisticsStage = BuildStage(
+	name = 'statistics', tool = 'yosys', inputs = ('{name}.il', '{name}.stat.ys'),
+	outputs = ('{name}.stat.json', '{name}.stat.rpt'), versionOption = '-V',
+	command = '"$YOSYS" -q -l {name}.stat.rpt {name}.stat.ys', chained = False
+)
+
+# Which iCE40 primitives count towards each of the resource types reported per module
+resourceTypes = {
+	'luts': re.compile(r'SB_LUT4'),
+	'ffs': re.compile(r'SB_DFF\w*'),
+	'carries': re.compile(r'SB_CARRY'),
+	'brams': re.compile(r'SB_RAM40_4K\w*'),
+	'dsps': re.compile(r'SB_MAC16'),
+	'sprams': re.compile(r'SB_SPRAM256KA'),
+}
+
+def addStatisticsScript(plan: 'BuildPlan', name: str) -> None:
+	# Derive the statistics script from the main synthesis script so both use the same options
+	script = plan.files[f'{name}.ys']
+	if isinstance(script, bytes):
+		script = script.decode('utf-8')
+	script = re.sub(r'^synth_ice40 ', 'synth_ice40 -noflatten ', script, flags = re.MULTILINE)
+	script = re.sub(r'^write_json .*$', f'tee -q -o {name}.stat.json stat -json', script, flags = re.MULTILINE)
+	plan.add_file(f'{name}.stat.ys', script)
+
+def _moduleUtilisation(statFile: Path) -> dict[str, dict[str, int]]:
+	with statFile.open('r') as file:
+		statistics = load(file)
+	modules: dict[str, dict[str, int]] = {}
+	for moduleName, module in statistics['modules'].items():
+		moduleName = moduleName.removeprefix('\\')
+		# Skip the I/O buffer wrappers and clock domain glue Torii adds around the design
+		leafName = moduleName.split('.')[-1]
+		if leafName.startswith('pin_') or leafName.startswith('cd_'):
+			continue
+		cells = module['num_cells_by_type']
+		modules[moduleName] = {
+			resource: sum(count for cell, count in cells.items() if pattern.fullmatch(cell))
+			for resource, pattern in resourceTypes.items()
+		}
+	return modules
+
+def buildSummary(buildDir: Path, name: str) -> dict:
+	with (buildDir / f'{name}.report.json').open('r') as file:
+		report = load(file)
+
+	clocks = {}
+	for clock, timing in report['fmax'].items():
+		achieved = timing['achieved']
+		constraint = timing['constraint']
+		clocks[clock] = {
+			'achieved': achieved,
+			'constraint': constraint,
+			'slack': (1000 / constraint) - (1000 / achieved),
+		}
+
+	summary = {
+		'design': name,
+		'fmax': clocks,
+		'utilisation': {
+			resource: {'used': usage['used'], 'available': usage['available']}
+			for resource, usage in report['utilization'].items()
+		},
+	}
+	statFile = buildDir / f'{name}.stat.json'
+	if statFile.exists():
+		summary['modules'] = _moduleUtilisation(statFile)
+	return summary
+
+def writeSummary(buildDir: Path, name: str) -> dict:
+	summary = buildSummary(buildDir, name)
+	with (buildDir / f'{name}.summary.json').open('w') as file:
+		dump(summary, file, indent = '\t')
+	return summary
+
+def loadSummary(fileName: Path) -> dict:
+	with fileName.open('r') as file:
+		return load(file)
+
+@dataclass(frozen = True)
+class SummaryChange:
+	metric: str
+	baseline: float | None
+	current: float | None
+	regression: bool
+
+	@property
+	def change(self) -> float | None:
+		if self.baseline is None or self.current is None or self.baseline == 0:
+			return None
+		return ((self.current - self.baseline) / self.baseline) * 100
+
+def _metrics(summary: dict) -> dict[str, tuple[float, bool]]:
+	# Flatten a summary into metric name -> (value, whether higher is better)
+	metrics: dict[str, tuple[float, bool]] = {}
+	for clock, timing in summary['fmax'].items():
+		metrics[f'fmax {clock}'] = (timing['achieved'], True)
+	for resource, usage in summary['utilisation'].items():
+		metrics[f'used {resource}'] = (usage['used'], False)
+	for module, resources in summary.get('modules', {}).items():
+		for resource, count in resources.items():
+			metrics[f'{module} {resource}'] = (count, False)
+	return metrics
+
+def compareSummaries(
+	baseline: dict, current: dict, *, areaTolerance: float = 0, fmaxTolerance: float = 5
+) -> list[SummaryChange]:
+	# Compare two build summaries, tolerances are in percent of the baseline value
+	baselineMetrics = _metrics(baseline)
+	currentMetrics = _metrics(current)
+	changes: list[SummaryChange] = []
+	for metric in sorted(baselineMetrics.keys() | currentMetrics.keys()):
+		baselineValue, higherIsBetter = baselineMetrics.get(metric, (None, None))
+		currentValue, higherIsBetter = currentMetrics.get(metric, (None, higherIsBetter))
+		regression = False
+		if baselineValue is not None and currentValue is not None:
+			if higherIsBetter:
+				regression = currentValue < baselineValue * (1 - fmaxTolerance / 100)
+			else:
+				regression = currentValue > baselineValue * (1 + areaTolerance / 100)
+		# Something that used no resources before and now does is always a regression
+		elif baselineValue is None and not higherIsBetter:
+			regression = bool(currentValue)
+		if baselineValue != currentValue or regression:
+			changes.append(SummaryChange(metric, baselineValue, currentValue, regression))
+
+	# Failing timing is always a regression regardless of what the baseline did
+	for clock, timing in current['fmax'].items():
+		if timing['achieved'] < timing['constraint']:
+			metric = f'fmax {clock}'
+			changes = [change for change in changes if change.metric != metric]
+			baselineValue = baseline['fmax'].get(clock, {}).get('achieved')
+			changes.append(SummaryChange(metric, baselineValue, timing['achieved'], True))
+	return changes
@@ -0,0 +1,325 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from configparser import ConfigParser
+from dataclasses import dataclass, field
+from pathlib import Path
+from zipfile import ZipFile
+import re
+import numpy as np
+from .itm import ITMPacketKind, ITMParser
+from .vcd import VCDFile
+
+__all__ = (
+	'ManchesterDecoder',
+	'StreamChecker',
+	'DecodeReport',
+	'parseSamplerate',
+	'sampleRuns',
+	'sigrokBinaryChunks',
+	'sigrokSessionChunks',
+	'vcdRuns',
+	'decodeCapture',
+)
+
+# How far (in half bit periods) an edge may land from where it should be before it counts as a code violation
+edgeTolerance = 0.3
+# Runs of more half bit periods than this are treated as idle, so there's no point keeping more of them
+idleHalfBits = 3
+
+class ManchesterDecoder:
+	'''
+	Vectorised decoder for the Manchester-coded SWO line.
+
+	The line is fed in as runs - a level and how long the line sat at it. Each run is quantised to a
+	number of half bit periods and expanded out to one entry per half bit, then frames are picked out of
+	that: a start bit (high then low), data bits sent LSB first with a 1 being high then low and a 0 being
+	low then high, and a stop bit that holds the line low for a whole bit period. Everything per run and
+	per bit is done with NumPy, only the framing loop runs once per frame in Python.
+	'''
+
+	def __init__(self, halfBitPeriod: float, maxFrameBits: int = 64) -> None:
+		self.halfBitPeriod = halfBitPeriod
+		self.maxFrameBits = maxFrameBits
+		# Treat the line as having been idle before the capture started so a frame right at the start is found
+		self.halfBits = np.zeros(2, dtype = np.uint8)
+		self.position = 2
+		# Code violations - edges in the wrong place and bits with no mid-bit transition
+		self.violations = 0
+		# Frames which ended on something other than a whole number of bytes, or never ended
+		self.framingErrors = 0
+		self.frames = 0
+		# Captures rarely start on a frame boundary, so errors only count once the first good frame is seen
+		self.synchronised = False
+		# Running totals for working out the actual baud rate of the line
+		self.timedDuration = 0.0
+		self.timedHalfBits = 0
+
+	def feedRuns(self, levels: np.ndarray, durations: np.ndarray, partial: bool = False) -> list[bytes]:
+		ratio = durations / self.halfBitPeriod
+		if partial:
+			# The capture ended part way through these runs, so only whole half bits of them count and they
+			# say nothing about the line's timing. Whatever frame is left incomplete after this is dropped
+			halfBits = np.floor(ratio + edgeTolerance).astype(np.int64)
+			np.minimum(halfBits, idleHalfBits, out = halfBits)
+			self.halfBits = np.concatenate((self.halfBits, np.repeat(levels.astype(np.uint8), halfBits)))
+			return self._decodeFrames()
+		halfBits = np.rint(ratio).astype(np.int64)
+		# Only runs of one or two half bit periods carry timing, anything longer is idle or a stuck line
+		timed = (halfBits >= 1) & (halfBits <= 2)
+		mistimed = timed & (np.abs(ratio - halfBits) > edgeTolerance)
+		self.violations += int(np.count_nonzero(mistimed) + np.count_nonzero(halfBits == 0))
+		good = timed & ~mistimed
+		self.timedDuration += float(durations[good].sum())
+		self.timedHalfBits += int(halfBits[good].sum())
+
+		np.minimum(halfBits, idleHalfBits, out = halfBits)
+		self.halfBits = np.concatenate((self.halfBits, np.repeat(levels.astype(np.uint8), halfBits)))
+		return self._decodeFrames()
+
+	def _decodeFrames(self) -> list[bytes]:
+		halfBits = self.halfBits
+		# A frame can only start on a high half bit coming after at least a bit period of the line being low
+		starts = np.flatnonzero((halfBits[2:] == 1) & (halfBits[1:-1] == 0) & (halfBits[:-2] == 0)) + 2
+		# Each frame is at most the start bit, the data bits and the stop bit
+		frameHalfBits = (self.maxFrameBits + 2) * 2
+		frames: list[bytes] = []
+		position = self.position
+		while True:
+			index = np.searchsorted(starts, position)
+			if index == len(starts):
+				position = max(position, len(halfBits) - 2)
+				break
+			start = int(starts[index])
+			symbols = halfBits[start:start + frameHalfBits]
+			symbols = symbols[:len(symbols) & ~1].reshape(-1, 2)
+			# Turn each pair of half bits into a symbol: 0 = stop, 1 = 0 bit, 2 = 1 bit, 3 = violation
+			codes = (symbols[:, 0] << 1) | symbols[:, 1]
+			ends = np.flatnonzero((codes == 0) | (codes == 3))
+			if not len(ends):
+				if len(codes) * 2 < frameHalfBits:
+					# The rest of the frame hasn't arrived yet
+					position = start
+					break
+				self.framingErrors += self.synchronised
+				position = start + 1
+				continue
+			end = int(ends[0])
+			if codes[end] == 3:
+				self.violations += self.synchronised
+				position = start + (end * 2) + 1
+				continue
+			bits = codes[1:end] == 2
+			if not len(bits) or len(bits) % 8:
+				self.framingErrors += self.synchronised
+				position = start + 1
+				continue
+			position = start + (end * 2) + 2
+			self.synchronised = True
+			frames.append(np.packbits(bits, bitorder = 'little').tobytes())
+
+		self.frames += len(frames)
+		# Hang on to anything not yet decoded, along with enough history to spot the next start bit
+		keep = max(position - 2, 0)
+		self.halfBits = halfBits[keep:]
+		self.position = position - keep
+		return frames
+
+	def baudRate(self, sampleRate: float) -> float | None:
+		if not self.timedHalfBits:
+			return None
+		return sampleRate / (2 * self.timedDuration / self.timedHalfBits)
+
+class StreamChecker:
+	'''
+	Checks decoded frames against the frames the generator is expected to send, which it sends repeatedly.
+
+	The first frame that matches an expected one sets where in the stream we are, after which each frame is
+	compared against the next expected. Frames that differ are counted as bit errors, unless they exactly
+	match a later expected frame in which case the frames in between were lost and the checker skips ahead.
+	'''
+
+	def __init__(self, expected: list[bytes]) -> None:
+		self.expected = expected
+		self.positions: dict[bytes, list[int]] = {}
+		for position, frame in enumerate(expected):
+			self.positions.setdefault(frame, []).append(position)
+		self.position: int | None = None
+		self.bitErrors = 0
+		self.missingFrames = 0
+		self.unsynchronisedFrames = 0
+
+	def check(self, frame: bytes) -> None:
+		positions = self.positions.get(frame)
+		if self.position is None:
+			if positions is None:
+				self.unsynchronisedFrames += 1
+				return
+			self.position = positions[0]
+		expected = self.expected[self.position]
+		if frame != expected:
+			if positions is not None:
+				# Pick whichever copy of the frame comes up next in the stream
+				position = min(positions, key = lambda position: (position - self.position) % len(self.expected))
+				self.missingFrames += (position - self.position) % len(self.expected)
+				self.position = position
+			else:
+				difference = np.bitwise_xor(
+					np.frombuffer(frame.ljust(len(expected), b'\0'), dtype = np.uint8),
+					np.frombuffer(expected.ljust(len(frame), b'\0'), dtype = np.uint8),
+				)
+				self.bitErrors += int(np.unpackbits(difference).sum())
+		self.position = (self.position + 1) % len(self.expected)
+
+@dataclass
+class DecodeReport:
+	frames: int
+	violations: int
+	framingErrors: int
+	bitErrors: int
+	missingFrames: int
+	unsynchronisedFrames: int
+	baudRate: float | None
+	packets: Counter = field(default_factory = Counter)
+	# Number of instrumentation packets seen on each stimulus port
+	ports: Counter = field(default_factory = Counter)
+
+	@property
+	def errors(self) -> int:
+		return self.violations + self.framingErrors + self.bitErrors + self.missingFrames
+
+def parseSamplerate(value: str) -> float:
+	# Accept sample rates the way sigrok writes them, eg '24 MHz', as well as plain numbers
+	match = re.fullmatch(r'\s*([0-9.]+)\s*([kMG]?)(?:Hz)?\s*', value)
+	if match is None:
+		raise ValueError(f'Invalid sample rate \'{value}\'')
+	return float(match[1]) * {'': 1, 'k': 1e3, 'M': 1e6, 'G': 1e9}[match[2]]
+
+def sampleRuns(chunks: Iterable[np.ndarray]) -> Iterator[tuple[np.ndarray, np.ndarray, bool]]:
+	# Turn chunks of 0/1 samples into runs, carrying the run at the end of each chunk over into the next.
+	# Each set of runs comes with whether the capture ended part way through them
+	level: int | None = None
+	length = 0
+	# The capture starts part way through a run, which has no meaningful length so gets dropped
+	partial = True
+	for chunk in chunks:
+		if not len(chunk):
+			continue
+		edges = np.flatnonzero(chunk[1:] != chunk[:-1]) + 1
+		bounds = np.concatenate(([0], edges, [len(chunk)]))
+		levels = chunk[bounds[:-1]]
+		durations = np.diff(bounds)
+		if level is not None:
+			if levels[0] == level:
+				durations[0] += length
+			else:
+				levels = np.concatenate(([level], levels))
+				durations = np.concatenate(([length], durations))
+		if partial and len(levels) > 1:
+			levels = levels[1:]
+			durations = durations[1:]
+			partial = False
+		level = int(levels[-1])
+		length = int(durations[-1])
+		yield levels[:-1], durations[:-1], False
+	# It also ends part way through one
+	if not partial:
+		yield np.array([level], dtype = np.uint8), np.array([length]), True
+
+def sigrokBinaryChunks(fileName: Path, channel: int, unitSize: int, chunkSize: int) -> Iterator[np.ndarray]:
+	# Raw sigrok binary output (`sigrok-cli -O binary`) is `unitSize` bytes per sample with one bit per channel
+	data = np.memmap(fileName, dtype = np.uint8, mode = 'r')
+	samples = data[:(len(data) // unitSize) * unitSize].reshape(-1, unitSize)[:, channel // 8]
+	for begin in range(0, len(samples), chunkSize):
+		yield (samples[begin:begin + chunkSize] >> (channel % 8)) & 1
+
+def _sessionMetadata(session: ZipFile) -> dict[str, str]:
+	metadata = ConfigParser()
+	metadata.read_string(session.read('metadata').decode('utf-8'))
+	# The first device section describes the capture
+	device = next(section for section in metadata.sections() if section.startswith('device'))
+	return dict(metadata[device])
+
+def sigrokSessionChunks(fileName: Path, channel: int | None, chunkSize: int) -> tuple[float, Iterator[np.ndarray]]:
+	# sigrok session files are a zip of a metadata file and the capture split across `logic-1-N` files
+	session = ZipFile(fileName)
+	metadata = _sessionMetadata(session)
+	sampleRate = parseSamplerate(metadata['samplerate'])
+	unitSize = int(metadata['unitsize'])
+	if channel is None:
+		# Default to whichever probe looks to be SWO
+		channel = next(
+			(int(key.removeprefix('probe')) - 1 for key, value in metadata.items()
+				if key.startswith('probe') and value.lower() == 'swo'), 0
+		)
+	chunks = sorted(
+		(name for name in session.namelist() if name.startswith('logic-1')),
+		key = lambda name: int(name.rsplit('-', 1)[1])
+	)
+
+	def readChunks():
+		with session:
+			for name in chunks:
+				data = np.frombuffer(session.read(name), dtype = np.uint8)
+				samples = data[:(len(data) // unitSize) * unitSize].reshape(-1, unitSize)[:, channel // 8]
+				for begin in range(0, len(samples), chunkSize):
+					yield (samples[begin:begin + chunkSize] >> (channel % 8)) & 1
+	return sampleRate, readChunks()
+
+def vcdRuns(
+	vcd: VCDFile, signal: str, chunkSize: int
+) -> tuple[float, Iterator[tuple[np.ndarray, np.ndarray, bool]]]:
+	# VCDs are already run length encoded, so just pull out the change times and values in bulk
+	times, values = vcd.scalarChanges(signal)
+	times = np.frombuffer(times, dtype = np.uint64).astype(np.int64)
+	# Anything that isn't a solid 1 (x or z) is taken as the line being low
+	levels = (np.frombuffer(values, dtype = np.uint8) == ord('1')).astype(np.uint8)
+	# The first run is just however long the line happened to sit at its initial value before it first changed, so
+	# has no meaningful length and gets dropped, the same as for the partial run a sampled capture starts with
+	durations = np.diff(times)[1:]
+	levels = levels[1:]
+
+	def readRuns():
+		# Every change but the last has a run length
+		for begin in range(0, len(durations), chunkSize):
+			end = min(begin + chunkSize, len(durations))
+			yield levels[begin:end], durations[begin:end], False
+		# The line sits at the last value until the simulation stopped
+		if len(levels):
+			yield levels[-1:], np.array([vcd.endTime - times[-1]]), True
+	# Timestamps are in units of the timescale, which is in femtoseconds
+	return 1e15 / vcd.timescale, readRuns()
+
+def decodeCapture(
+	runs: Iterable[tuple[np.ndarray, np.ndarray, bool]], sampleRate: float, baudRate: float, expected: list[bytes]
+) -> DecodeReport:
+	decoder = ManchesterDecoder(sampleRate / (2 * baudRate))
+	checker = StreamChecker(expected)
+	parser = ITMParser()
+	packets = Counter()
+	ports = Counter()
+
+	def process(frames: list[bytes]):
+		for frame in frames:
+			checker.check(frame)
+			for packet in parser.feed(frame):
+				packets[packet.kind] += 1
+				if packet.kind == ITMPacketKind.instrumentation:
+					ports[packet.port] += 1
+
+	for levels, durations, partial in runs:
+		process(decoder.feedRuns(levels, durations, partial))
+
+	return DecodeReport(
+		frames = decoder.frames,
+		violations = decoder.violations,
+		framingErrors = decoder.framingErrors,
+		bitErrors = checker.bitErrors,
+		missingFrames = checker.missingFrames,
+		unsynchronisedFrames = checker.unsynchronisedFrames,
+		baudRate = decoder.baudRate(sampleRate),
+		packets = packets,
+		ports = ports,
+	)
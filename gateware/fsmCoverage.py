@@ -0,0 +1,235 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from dataclasses import dataclass, field
+from os import getpid
+from pathlib import Path
+from json import dump, load
+from torii.hdl.ast import Assign, Const, Signal, Switch
+from torii.hdl.ir import Fragment
+from torii.sim import Simulator
+from torii.sim._base import BaseProcess
+
+__all__ = (
+	'coverageEnvironment',
+	'FSM',
+	'FSMCoverage',
+	'findFSMs',
+)
+
+# When set, this names the directory simulation runs should drop their FSM coverage shards into
+coverageEnvironment = 'SWO_FSM_COVERAGE'
+
+@dataclass
+class FSM:
+	# Name of the FSM qualified by the file that defines it, eg 'swo.swo' or 'manchester.manchester'
+	name: str
+	location: str
+	signal: Signal
+	# Mapping from state encoding to state name
+	states: dict[int, str]
+	# The (from, to) state transitions the FSM description contains
+	transitions: set[tuple[str, str]] = field(default_factory = set)
+
+def _fsmTransitions(statements, signal: Signal, fromState: str, states: dict[int, str]):
+	for statement in statements:
+		# Look for `m.next = ...` assignments, which land as assignments of a constant to the state signal
+		if isinstance(statement, Assign):
+			if statement.lhs is signal and isinstance(statement.rhs, Const):
+				yield fromState, states[statement.rhs.value]
+		elif isinstance(statement, Switch):
+			for caseStatements in statement.cases.values():
+				yield from _fsmTransitions(caseStatements, signal, fromState, states)
+
+def _findFSMs(statements, fsms: list[FSM]):
+	for statement in statements:
+		if not isinstance(statement, Switch):
+			continue
+		test = statement.test
+		# FSMs are Switch statements on a state signal that has a decoder attached to name the states
+		if isinstance(test, Signal) and test.decoder is not None and test.name.endswith('_state'):
+			states = {encoding: test.decoder(encoding).split('/')[0] for encoding in range(2 ** test.width)
+				if _decodable(test, encoding)}
+			fileName, line = statement.src_loc
+			fsm = FSM(
+				name = f'{Path(fileName).stem}.{test.name.removesuffix("_state")}',
+				location = f'{Path(fileName).name}:{line}',
+				signal = test,
+				states = states,
+			)
+			for patterns, caseStatements in statement.cases.items():
+				for pattern in patterns:
+					fsm.transitions.update(_fsmTransitions(caseStatements, test, states[int(pattern, 2)], states))
+			fsms.append(fsm)
+		for caseStatements in statement.cases.values():
+			_findFSMs(caseStatements, fsms)
+
+def _decodable(signal: Signal, encoding: int):
+	try:
+		signal.decoder(encoding)
+		return True
+	except KeyError:
+		return False
+
+def findFSMs(fragment: Fragment) -> list[FSM]:
+	fsms: list[FSM] = []
+	_findFSMs(fragment.statements, fsms)
+	for subfragment, _ in fragment.subfragments:
+		fsms.extend(findFSMs(subfragment))
+	return fsms
+
+def _engineHooks(simulator: Simulator):
+	# Coverage hooks into the internals of Torii's Python simulation engine, which aren't a stable API. Check they are
+	# all still there, so a Torii upgrade that moves them fails loudly here rather than quietly recording nothing
+	engine = getattr(simulator, '_engine', None)
+	engineState = getattr(engine, '_state', None)
+	processes = getattr(engine, '_processes', None)
+	missing = [name for name, present in (
+		('_engine', engine is not None),
+		('_engine._state', engineState is not None),
+		('_engine._state.add_trigger', callable(getattr(engineState, 'add_trigger', None))),
+		('_engine._state.get_signal', callable(getattr(engineState, 'get_signal', None))),
+		('_engine._state.slots', hasattr(engineState, 'slots')),
+		('_engine._processes', isinstance(processes, set)),
+	) if not present]
+	if missing:
+		raise RuntimeError(f'Cannot collect FSM coverage, the simulator has no {", ".join(missing)}')
+	return engineState, processes
+
+class _FSMObserver(BaseProcess):
+	# Rather than sampling the FSMs every cycle, this hooks the simulator's signal change notifications so it
+	# only runs when one of the state signals actually changes, keeping the overhead to almost nothing
+	def __init__(self, simulator: Simulator, fsms: list[FSM]) -> None:
+		engineState, _ = _engineHooks(simulator)
+		self.fsms = fsms
+		self.slots = [engineState.slots[engineState.get_signal(fsm.signal)] for fsm in fsms]
+		self.visits: list[dict[int, int]] = [{} for _ in fsms]
+		self.transitions: list[dict[tuple[int, int], int]] = [{} for _ in fsms]
+		self.state = [fsm.signal.reset for fsm in fsms]
+		self.runnable = False
+		self.passive = True
+		for fsm in fsms:
+			engineState.add_trigger(self, fsm.signal)
+
+	def reset(self) -> None:
+		self.runnable = False
+		self.passive = True
+		# Every FSM starts off in its reset state
+		self.state = [fsm.signal.reset for fsm in self.fsms]
+		for visits, state in zip(self.visits, self.state):
+			visits[state] = visits.get(state, 0) + 1
+
+	def run(self) -> None:
+		for index, slot in enumerate(self.slots):
+			previous = self.state[index]
+			current = slot.curr
+			if current != previous:
+				self.state[index] = current
+				visits = self.visits[index]
+				visits[current] = visits.get(current, 0) + 1
+				transitions = self.transitions[index]
+				transitions[previous, current] = transitions.get((previous, current), 0) + 1
+
+class FSMCoverage:
+	def __init__(self) -> None:
+		# FSM name -> state name -> visit count
+		self.visits: dict[str, dict[str, int]] = {}
+		# FSM name -> 'FROM->TO' -> transition count
+		self.transitions: dict[str, dict[str, int]] = {}
+		# FSM name -> description of the FSM's location, states and declared transitions
+		self.declared: dict[str, dict] = {}
+		self._observers: list[_FSMObserver] = []
+
+	def attach(self, simulator: Simulator, fragment: Fragment) -> None:
+		_, processes = _engineHooks(simulator)
+		fsms = findFSMs(fragment)
+		for fsm in fsms:
+			self._declare(fsm.name, {
+				'location': fsm.location,
+				'states': list(fsm.states.values()),
+				'transitions': sorted(f'{fromState}->{toState}' for fromState, toState in fsm.transitions),
+			})
+		if fsms:
+			observer = _FSMObserver(simulator, fsms)
+			processes.add(observer)
+			self._observers.append(observer)
+
+	def _declare(self, name: str, description: dict) -> None:
+		self.declared.setdefault(name, description)
+		self.visits.setdefault(name, {})
+		self.transitions.setdefault(name, {})
+
+	def collect(self) -> None:
+		# Fold the raw counts from any attached simulations into the named totals
+		for observer in self._observers:
+			for fsm, visits, transitions in zip(observer.fsms, observer.visits, observer.transitions):
+				for state, count in visits.items():
+					name = fsm.states[state]
+					self.visits[fsm.name][name] = self.visits[fsm.name].get(name, 0) + count
+				for (fromState, toState), count in transitions.items():
+					name = f'{fsm.states[fromState]}->{fsm.states[toState]}'
+					self.transitions[fsm.name][name] = self.transitions[fsm.name].get(name, 0) + count
+		self._observers.clear()
+
+	def merge(self, other: 'FSMCoverage') -> None:
+		for name, description in other.declared.items():
+			self._declare(name, description)
+			for state, count in other.visits[name].items():
+				self.visits[name][state] = self.visits[name].get(state, 0) + count
+			for transition, count in other.transitions[name].items():
+				self.transitions[name][transition] = self.transitions[name].get(transition, 0) + count
+
+	def save(self, fileName: Path) -> None:
+		self.collect()
+		with fileName.open('w') as file:
+			dump({'declared': self.declared, 'visits': self.visits, 'transitions': self.transitions}, file, indent = '\t')
+
+	@classmethod
+	def load(cls, fileName: Path) -> 'FSMCoverage':
+		coverage = cls()
+		with fileName.open('r') as file:
+			data = load(file)
+		coverage.declared = data['declared']
+		coverage.visits = data['visits']
+		coverage.transitions = data['transitions']
+		return coverage
+
+	def saveShard(self, directory: Path) -> None:
+		# Each simulation process keeps its own shard, merging into it as more simulations complete
+		directory.mkdir(parents = True, exist_ok = True)
+		shard = directory / f'fsm-{getpid()}.json'
+		if shard.exists():
+			previous = FSMCoverage.load(shard)
+			self.collect()
+			previous.merge(self)
+			previous.save(shard)
+		else:
+			self.save(shard)
+
+	@classmethod
+	def fromShards(cls, directory: Path) -> 'FSMCoverage':
+		coverage = cls()
+		for shard in sorted(directory.glob('fsm-*.json')):
+			coverage.merge(cls.load(shard))
+		return coverage
+
+	def report(self) -> list[str]:
+		lines = []
+		for name, description in sorted(self.declared.items()):
+			visits = self.visits[name]
+			transitions = self.transitions[name]
+			states = description['states']
+			declared = description['transitions']
+			statesHit = sum(1 for state in states if state in visits)
+			transitionsHit = sum(1 for transition in declared if transition in transitions)
+			lines.append(
+				f'{name} ({description["location"]}): {statesHit}/{len(states)} states, '
+				f'{transitionsHit}/{len(declared)} transitions'
+			)
+			for state in states:
+				if state not in visits:
+					lines.append(f'  state {state} never visited')
+			for transition in declared:
+				if transition not in transitions:
+					lines.append(f'  transition {transition} never taken')
+		return lines
@@ -0,0 +1,104 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from dataclasses import dataclass
+from enum import Enum, unique
+
+__all__ = (
+	'ITMPacketKind',
+	'ITMPacket',
+	'ITMParser',
+)
+
+@unique
+class ITMPacketKind(Enum):
+	sync = 'sync'
+	overflow = 'overflow'
+	localTimestamp = 'local timestamp'
+	globalTimestamp = 'global timestamp'
+	extension = 'extension'
+	instrumentation = 'instrumentation'
+	hardware = 'hardware'
+	reserved = 'reserved'
+
+@dataclass(frozen = True)
+class ITMPacket:
+	kind: ITMPacketKind
+	# Stimulus port or hardware source the packet came from, for source packets
+	port: int | None
+	# The packet's bytes, including the header
+	data: bytes
+
+	@property
+	def payload(self) -> bytes:
+		return self.data[1:]
+
+# Number of payload bytes a source packet carries, indexed on the bottom 2 bits of its header
+sourcePayloadLength = (0, 1, 2, 4)
+
+class ITMParser:
+	'''
+	Incremental ITM packet parser.
+
+	Bytes are fed in as they are decoded and whole packets handed back, with any packet that is split
+	across calls held over until the rest of it arrives. Packet framing follows section D4.2 of the
+	ARMv7-M Architecture Reference Manual.
+	'''
+
+	def __init__(self) -> None:
+		self._buffer = bytearray()
+
+	def feed(self, data: bytes) -> list[ITMPacket]:
+		self._buffer += data
+		packets: list[ITMPacket] = []
+		offset = 0
+		while offset < len(self._buffer):
+			length, kind = self._packetLength(offset)
+			# If the packet is not all here yet, wait for more data
+			if length is None:
+				break
+			packet = bytes(self._buffer[offset:offset + length])
+			port = packet[0] >> 3 if kind in (ITMPacketKind.instrumentation, ITMPacketKind.hardware) else None
+			packets.append(ITMPacket(kind, port, packet))
+			offset += length
+		del self._buffer[:offset]
+		return packets
+
+	def _continuationLength(self, offset: int) -> int | None:
+		# Protocol packets carry on for as long as bit 7 of the byte just read is set
+		length = 1
+		while self._buffer[offset + length - 1] & 0x80:
+			if offset + length >= len(self._buffer):
+				return None
+			length += 1
+		return length
+
+	def _packetLength(self, offset: int) -> tuple[int | None, ITMPacketKind]:
+		header = self._buffer[offset]
+		if header == 0x00:
+			# Synchronisation packets are at least 47 0 bits followed by a 1, which lands as a run of 0x00's then 0x80
+			end = offset
+			while end < len(self._buffer) and self._buffer[end] == 0x00:
+				end += 1
+			if end == len(self._buffer):
+				return None, ITMPacketKind.sync
+			if self._buffer[end] == 0x80 and end - offset >= 5:
+				return end - offset + 1, ITMPacketKind.sync
+			return end - offset, ITMPacketKind.reserved
+		elif header == 0x70:
+			return 1, ITMPacketKind.overflow
+		elif header & 0x03:
+			length = 1 + sourcePayloadLength[header & 0x03]
+			if offset + length > len(self._buffer):
+				return None, ITMPacketKind.instrumentation
+			kind = ITMPacketKind.hardware if header & 0x04 else ITMPacketKind.instrumentation
+			return length, kind
+		elif header & 0x0f == 0x00:
+			kind = ITMPacketKind.localTimestamp
+		elif header & 0xdf == 0x94:
+			kind = ITMPacketKind.globalTimestamp
+		elif header & 0x0b == 0x08:
+			kind = ITMPacketKind.extension
+		else:
+			return 1, ITMPacketKind.reserved
+		return self._continuationLength(offset), kind
@@ -3,33 +3,40 @@
 # SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
 from torii import Elaboratable, Module, Signal, Shape, Memory
 from torii.build import Platform
+from .stimulus import StimulusImage
 
 __all__ = (
 	'ITMStimulusROM',
 )
 
-def itmStreamData():
-	for char in range(ord('A'), ord('Z') + 1):
-		yield char
-	for char in range(ord('a'), ord('z') + 1):
-		yield char
-	for char in range(ord('0'), ord('9') + 1):
-		yield char
-	yield ord('\r')
-	yield ord('\n')
-
 class ITMStimulusROM(Elaboratable):
-	def __init__(self):
-		self.data = Signal(Shape(16, False))
-		self.entry = Signal(range(64), reset = 0)
+	def __init__(self, image: StimulusImage | None = None, checkPort: bool = False):
+		self.image = image if image is not None else StimulusImage.default()
+		self.depth = len(self.image.data)
+		# The ROM holds the ITM packets packed back to back and is read out a byte at a time
+		self.data = Signal(Shape(8, False))
+		self.entry = Signal(range(self.depth), reset = 0)
+		# Pulse to step to the next byte, wrapping back round to the start at the end of the stream
+		self.advance = Signal()
+
+		# Optional second read port for checking what was sent against
+		self.checkPort = checkPort
+		self.checkData = Signal(Shape(8, False))
+		self.checkEntry = Signal(range(self.depth))
 
 	def elaborate(self, _: Platform) -> Module:
 		m = Module()
 
-		# Create a new memory to store the ROM in
-		m.submodules.rom = rom = Memory(width = 16, depth = 64)
+		# Create a new memory to store the ROM in, which Yosys spreads across as many EBR blocks as it needs
+		m.submodules.rom = rom = Memory(width = 8, depth = self.depth)
 		# Initialise the ROM with the ITM stream data
-		rom.init = [(value << 8) | 0x01 for value in itmStreamData()]
+		rom.init = list(self.image.data)
+
+		with m.If(self.advance):
+			with m.If(self.entry == self.depth - 1):
+				m.d.sync += self.entry.eq(0)
+			with m.Else():
+				m.d.sync += self.entry.eq(self.entry + 1)
 
 		# Hook up the read side of the memory and make it available
 		readPort = rom.read_port()
@@ -39,4 +46,12 @@ class ITMStimulusROM(Elaboratable):
 			readPort.en.eq(1),
 		]
 
+		if self.checkPort:
+			checkPort = rom.read_port()
+			m.d.comb += [
+				checkPort.addr.eq(self.checkEntry),
+				self.checkData.eq(checkPort.data),
+				checkPort.en.eq(1),
+			]
+
 		return m
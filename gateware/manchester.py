@@ -1,15 +1,19 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
 # SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
-from torii import Elaboratable, Module, Signal
+from torii import Elaboratable, Module, Signal, Cat
 from torii.build import Platform
+from torii.lib.cdc import FFSynchronizer
 
 __all__ = (
 	'ManchesterEncoder',
+	'ManchesterDecoder',
 )
 
 class ManchesterEncoder(Elaboratable):
-	def __init__(self) -> None:
+	def __init__(self, baudRate: int = 115200) -> None:
+		self.baudRate = baudRate
+
 		# Data bit to encode
 		self.bitIn = Signal()
 		# Manchester coded data stream out
@@ -26,8 +30,8 @@ class ManchesterEncoder(Elaboratable):
 	def elaborate(self, platform: Platform) -> Module:
 		m = Module()
 
-		# Set up a counter to encode data at 115200 baud
-		bitPeriod = int(platform.default_clk_frequency // 115200)
+		# Set up a counter to encode data at the requested baud rate
+		bitPeriod = int(platform.default_clk_frequency // self.baudRate)
 		halfBitPeriod = bitPeriod // 2
 		halfBitPeriodCounter = Signal(range(halfBitPeriod), reset = 0)
 
@@ -102,3 +106,130 @@ class ManchesterEncoder(Elaboratable):
 						m.next = 'IDLE'
 
 		return m
+
+class ManchesterDecoder(Elaboratable):
+	def __init__(self, baudRate: int = 115200) -> None:
+		self.baudRate = baudRate
+
+		# Manchester coded data stream in
+		self.manchesterIn = Signal()
+
+		# Decoded data byte out, valid while dataValid is high
+		self.data = Signal(8)
+		self.dataValid = Signal()
+		# Frame condition signals
+		self.frameStart = Signal()
+		self.frameEnd = Signal()
+		# Pulsed when a frame ends badly - on a code violation or on a partial byte
+		self.frameError = Signal()
+
+	def elaborate(self, platform: Platform) -> Module:
+		m = Module()
+
+		# Work out the bit timings, sampling each half of each bit in the middle of that half
+		bitPeriod = int(platform.default_clk_frequency // self.baudRate)
+		halfBitPeriod = bitPeriod // 2
+		quarterBitPeriod = bitPeriod // 4
+
+		# Bring the line into our clock domain and look for edges on it
+		line = Signal()
+		lineDelayed = Signal()
+		m.submodules += FFSynchronizer(self.manchesterIn, line)
+		m.d.sync += lineDelayed.eq(line)
+		edge = line ^ lineDelayed
+
+		# Keep track of how long the line has been low, so we know when it's idle. A 1 bit followed by a 0 bit holds
+		# the line low for a whole bit period, so idle is taken to be at least one and a half bit periods of low. The
+		# line may be part way through a frame when we start, so don't assume it has been idle
+		idleTime = bitPeriod + halfBitPeriod
+		lowTime = Signal(range(idleTime + 1))
+		with m.If(line):
+			m.d.sync += lowTime.eq(0)
+		with m.Elif(lowTime != idleTime):
+			m.d.sync += lowTime.eq(lowTime + 1)
+
+		# Free-running bit timer, which gets locked to the transmitter by the start of each frame and mid-bit edges
+		bitTimer = Signal(range(bitPeriod))
+		firstHalfSample = bitTimer == quarterBitPeriod
+		secondHalfSample = bitTimer == halfBitPeriod + quarterBitPeriod
+		with m.If(bitTimer == bitPeriod - 1):
+			m.d.sync += bitTimer.eq(0)
+		with m.Else():
+			m.d.sync += bitTimer.eq(bitTimer + 1)
+
+		# Internal signals for holding the first half of the bit and the data bits received so far
+		firstHalf = Signal()
+		bit = Signal(range(8))
+		data = Signal(8)
+		haveData = Signal()
+		# Set when the frame being decoded has had a code violation in it, after which we keep in step with the bits
+		# but throw them away until the stop bit
+		violation = Signal()
+		# Set when a stop bit has just been seen. In continuous mode the next frame's start bit follows straight on
+		# from the stop bit, with no idle time between, so that's when a frame may start without the line being idle
+		afterStop = Signal()
+
+		m.d.comb += self.data.eq(Cat(data[1:], firstHalf))
+
+		with m.FSM(name = 'receiver') as fsm:
+			with m.State('IDLE'):
+				# A frame starts with the line going high after having been idle, or right after the last one's stop bit
+				with m.If(line & ~lineDelayed & ((lowTime == idleTime) | afterStop)):
+					m.d.comb += self.frameStart.eq(1)
+					m.d.sync += [
+						bitTimer.eq(1),
+						bit.eq(0),
+						haveData.eq(0),
+						violation.eq(0),
+						afterStop.eq(0),
+					]
+					m.next = 'START_BIT'
+				# The stop bit is seen three quarters of the way through, so if the line hasn't gone high by a quarter
+				# of the way into the bit after, there's no frame following on and the line has to go idle first
+				with m.Elif(bitTimer == quarterBitPeriod):
+					m.d.sync += afterStop.eq(0)
+			with m.State('START_BIT'):
+				# The start bit is just high then low, if it isn't then it was a glitch rather than a frame
+				with m.If(secondHalfSample):
+					with m.If(line):
+						m.next = 'IDLE'
+					with m.Else():
+						m.next = 'BIT_DECODE'
+			with m.State('BIT_DECODE'):
+				with m.If(firstHalfSample):
+					m.d.sync += firstHalf.eq(line)
+				with m.Elif(secondHalfSample):
+					# Work out what the bit was from its two halves
+					with m.Switch(Cat(line, firstHalf)):
+						# High then low or low then high are 1 and 0 bits respectively
+						with m.Case('10', '01'):
+							m.d.sync += [
+								data.eq(Cat(data[1:], firstHalf)),
+								bit.eq(bit + 1),
+							]
+							with m.If((bit == 7) & ~violation):
+								m.d.comb += self.dataValid.eq(1)
+								m.d.sync += haveData.eq(1)
+						# Low for the whole bit is the stop bit, which must come after a whole number of bytes
+						with m.Case('00'):
+							# A frame with a code violation in it has already been reported as bad
+							with m.If(~violation):
+								with m.If(haveData & (bit == 0)):
+									m.d.comb += self.frameEnd.eq(1)
+								with m.Else():
+									m.d.comb += self.frameError.eq(1)
+							m.d.sync += afterStop.eq(1)
+							m.next = 'IDLE'
+						# High for the whole bit is a code violation. Going idle here would leave us looking for a gap
+						# between frames that continuous mode never gives, so carry on through to the stop bit instead
+						with m.Case('11'):
+							with m.If(~violation):
+								m.d.comb += self.frameError.eq(1)
+							m.d.sync += violation.eq(1)
+
+		# The middle of each bit always has a transition, so use those to keep the bit timer in step
+		midBit = (bitTimer > quarterBitPeriod) & (bitTimer < halfBitPeriod + quarterBitPeriod)
+		with m.If(edge & midBit & ~fsm.ongoing('IDLE')):
+			m.d.sync += bitTimer.eq(halfBitPeriod + 1)
+
+		return m
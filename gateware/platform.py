@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from copy import deepcopy
+from torii.build import Resource, Subsignal, Pins, DiffPairs, Attrs
+from torii_boards.lattice.icebreaker import ICEBreakerPlatform
+
+__all__ = (
+	'SWOPlatform',
+	'swoPlatform',
+	'designResources',
+	'reservedPins',
+)
+
+class SWOPlatform(ICEBreakerPlatform):
+	def __init__(self) -> None:
+		# Torii removes the GLOBAL attribute from the clock's resource when it makes the clock's I/O buffer, and the
+		# board's resources are shared between all instances of the platform. Give each instance its own copy so that
+		# every design prepared in a run (such as for a build matrix) gets its clock on a global buffer
+		self.resources = deepcopy(ICEBreakerPlatform.resources)
+		super().__init__()
+
+def swoPlatform(swoPin: str = '46', triggerPin: str = '44'):
+	platform = SWOPlatform()
+	platform.add_resources([
+		Resource('swo', 0,
+			Subsignal('swo', Pins(swoPin, dir = 'o'), Attrs(IO_STANDARD = 'SB_LVCMOS')),
+			Subsignal('trigger', Pins(triggerPin, dir = 'i'), Attrs(IO_STANDARD = 'SB_LVCMOS')),
+		),
+		# Jumper this to the SWO pin to check the output through the I/O path with the BER tester
+		Resource('loopback', 0, Pins('45', dir = 'i'), Attrs(IO_STANDARD = 'SB_LVCMOS')),
+	])
+	platform.add_resources(platform.break_off_pmod)
+	return platform
+
+# Resources the design requests other than the SWO resource itself, whether or not the loopback BER tester is in use
+designResources = (
+	('clk12', 0), ('button', 0), ('led', 0), ('led', 1), ('led', 2), ('led', 3), ('uart', 0), ('loopback', 0),
+)
+
+def _resourcePins(resource: Resource | Subsignal, connectorPins: dict[str, str]) -> list[str]:
+	pins: list[str] = []
+	for io in resource.ios:
+		if isinstance(io, Subsignal):
+			pins += _resourcePins(io, connectorPins)
+		elif isinstance(io, DiffPairs):
+			pins += io.p.map_names(connectorPins, resource) + io.n.map_names(connectorPins, resource)
+		else:
+			pins += io.map_names(connectorPins, resource)
+	return pins
+
+def reservedPins() -> dict[str, str]:
+	# Map of the physical pins used by the resources in designResources to the resource using each, which the
+	# SWO and trigger pins must stay off of
+	platform = swoPlatform()
+	connectorPins = {
+		connectorPin: platformPin
+		for connector in platform.connectors.values() for connectorPin, platformPin in connector
+	}
+	pins: dict[str, str] = {}
+	for name, number in designResources:
+		for pin in _resourcePins(platform.lookup(name, number), connectorPins):
+			pins[pin] = f'{name}#{number}'
+	return pins
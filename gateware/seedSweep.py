@@ -0,0 +1,106 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from argparse import ArgumentTypeError
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from json import load
+from pathlib import Path
+from shlex import split
+from subprocess import CalledProcessError
+import re
+from .buildCache import BuildCache
+
+__all__ = (
+	'SeedResult',
+	'parseSeeds',
+	'timingSummary',
+	'sweepSeeds',
+	'bestSeed',
+)
+
+@dataclass(frozen = True)
+class SeedResult:
+	seed: int
+	buildDir: Path
+	# Achieved and target frequency of the worst clock in MHz, and its slack in ns
+	fmax: float | None = None
+	constraint: float | None = None
+	slack: float | None = None
+	cached: bool = False
+	error: str | None = None
+
+def parseSeeds(value: str) -> list[int]:
+	# Seeds may be given as a single seed, an inclusive A-B range, or a comma separated list of either
+	seeds: list[int] = []
+	for part in value.split(','):
+		match = re.fullmatch(r'\s*(\d+)\s*(?:-\s*(\d+)\s*)?', part)
+		if match is None:
+			raise ArgumentTypeError(f'\'{part}\' is not a seed or range of seeds')
+		begin = int(match[1])
+		end = int(match[2]) if match[2] is not None else begin
+		if end < begin:
+			raise ArgumentTypeError(f'Seed range \'{part}\' is backwards')
+		seeds.extend(range(begin, end + 1))
+	# Drop any seeds given more than once, keeping the rest in the order they were first given
+	return list(dict.fromkeys(seeds))
+
+def timingSummary(reportFile: Path) -> tuple[float, float, float]:
+	# Pull the clock with the least slack out of a nextpnr `--report` JSON file
+	with reportFile.open('r') as file:
+		report = load(file)
+	worst = None
+	for clock in report['fmax'].values():
+		achieved = clock['achieved']
+		constraint = clock['constraint']
+		slack = (1000 / constraint) - (1000 / achieved)
+		if worst is None or slack < worst[2]:
+			worst = (achieved, constraint, slack)
+	if worst is None:
+		raise ValueError(f'Timing report {reportFile} contains no clocks')
+	return worst
+
+def _seedCommand(command: str, seed: int) -> str:
+	if re.search(r'--seed[= ]\d+', command) is None:
+		return f'{command} --seed={seed}'
+	return re.sub(r'--seed([= ])\d+', f'--seed\\g<1>{seed}', command)
+
+def _reportFile(cache: BuildCache) -> str | None:
+	arguments = split(cache.command('place-and-route'))
+	if '--report' not in arguments:
+		return None
+	return arguments[arguments.index('--report') + 1]
+
+def _placeAndRoute(cache: BuildCache, seed: int, useCache: bool) -> SeedResult:
+	buildDir = cache.buildDir / 'seeds' / f'seed-{seed}'
+	variant = cache.variant(buildDir, {'place-and-route': _seedCommand(cache.command('place-and-route'), seed)})
+	try:
+		# Synthesis has already been run by the time we get here, so always take it from the cache
+		variant.execute(stages = ('synthesis', ))
+		hits = variant.execute(useCache = useCache, stages = ('place-and-route', 'bitstream'))
+	except CalledProcessError as error:
+		return SeedResult(seed, buildDir, error = f'toolchain exited with status {error.returncode}')
+
+	cached = all(hits.values())
+	reportFile = _reportFile(variant)
+	if reportFile is None:
+		return SeedResult(seed, buildDir, cached = cached, error = 'no timing report requested')
+	try:
+		fmax, constraint, slack = timingSummary(buildDir / reportFile)
+	except (OSError, ValueError, KeyError, TypeError) as error:
+		return SeedResult(seed, buildDir, cached = cached, error = f'unreadable timing report: {error}')
+	return SeedResult(seed, buildDir, fmax, constraint, slack, cached)
+
+def sweepSeeds(cache: BuildCache, seeds: list[int], jobs: int | None, useCache: bool = True) -> list[SeedResult]:
+	# Synthesise just the once up front, then place-and-route each seed in parallel from the shared netlist
+	cache.execute(useCache = useCache, stages = ('synthesis', ))
+	with ProcessPoolExecutor(max_workers = jobs) as pool:
+		futures = [pool.submit(_placeAndRoute, cache, seed, useCache) for seed in seeds]
+		return [future.result() for future in futures]
+
+def bestSeed(results: list[SeedResult]) -> SeedResult | None:
+	# The best run is the one with the most slack on its worst clock, using Fmax to break ties
+	passing = [result for result in results if result.error is None]
+	if not passing:
+		return None
+	return max(passing, key = lambda result: (result.slack, result.fmax))
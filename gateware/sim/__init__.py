@@ -1,3 +1,123 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
 # SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from dataclasses import dataclass
+from functools import cache
+from os import getenv
+from pathlib import Path
+from warnings import warn
+import re
+from torii import Elaboratable, Module, __version__ as toriiVersion
+from torii.hdl.ir import Fragment
+from torii.sim import Simulator
+from torii.sim.pysim import PySimEngine
+from torii.test import ToriiTestCase
+from ..fsmCoverage import FSMCoverage, coverageEnvironment
+
+__all__ = (
+	'SimulationTestCase',
+	'ElaboratedDesign',
+	'elaboratedDesigns',
+)
+
+@dataclass(frozen = True)
+class ElaboratedDesign:
+	dut: Elaboratable
+	# The design as elaborated for the platform, and after being prepared for simulation
+	fragment: Fragment
+	prepared: Fragment
+
+class _PreparedSimulator(Simulator):
+	# Torii's simulator prepares the fragment it's given every time, which can't be done twice to the same fragment.
+	# This does everything else the same, but starts from a fragment that has already been prepared. That means
+	# setting up the simulator's private state the way Torii does, so this is only used with the versions of Torii
+	# it is known to match - see supported()
+	versions = ((0, 7), )
+	state = ('_fragment', '_engine', '_clocked')
+
+	def __init__(self, prepared: Fragment) -> None:
+		self._fragment = prepared
+		self._engine = PySimEngine(prepared)
+		self._clocked = set()
+
+	@staticmethod
+	@cache
+	def supported() -> bool:
+		version = tuple(int(part) for part in re.findall(r'\d+', toriiVersion)[:2])
+		if version not in _PreparedSimulator.versions:
+			warn(f'Torii {toriiVersion} is not known to support reusing prepared designs, elaborating every test\'s DUT')
+			return False
+		# Make sure the simulator still keeps its state where we expect, in case it changed within a release series
+		simulator = Simulator(Module())
+		missing = [name for name in _PreparedSimulator.state if not hasattr(simulator, name)]
+		if missing:
+			warn(f'Torii {toriiVersion} simulator has no {", ".join(missing)}, elaborating every test\'s DUT')
+			return False
+		return True
+
+# Designs elaborated so far in this run. All the simulation state lives in the simulator, so test cases can share a
+# design as long as it was built the same way
+elaboratedDesigns: dict[tuple, ElaboratedDesign] = {}
+
+def _argumentKey(value):
+	# Use the value itself where it can be hashed, and otherwise (eg for Signals) the identity of the object
+	try:
+		hash(value)
+		return value
+	except TypeError:
+		return ('id', id(value))
+
+class SimulationTestCase(ToriiTestCase):
+	'''
+	Test case that only elaborates its DUT once per run.
+
+	Elaborating a design and preparing it for simulation costs the same every time, and would be done for every test
+	otherwise. Instead, designs are kept by the DUT class, the platform and the arguments used to build the DUT, and
+	each test gets a fresh simulator over the design built the first time. The design must not be changed by tests,
+	nor depend on anything other than those for how it elaborates.
+	'''
+
+	def designKey(self) -> tuple:
+		arguments = tuple(sorted((name, _argumentKey(value)) for name, value in self.dut_args.items()))
+		# Once set up, `dut` is the DUT itself, so get the class it was built from off the test case class
+		return (type(self).dut, _argumentKey(self.platform), arguments)
+
+	def setUp(self) -> None:
+		# Without a DUT, or with a version of Torii we can't reuse designs with, set up as normal
+		if self.dut is None or not _PreparedSimulator.supported():
+			return super().setUp()
+
+		key = self.designKey()
+		design = elaboratedDesigns.get(key)
+		if design is None:
+			dut = self.init_dut()
+			fragment = Fragment.get(dut, self.platform)
+			design = ElaboratedDesign(dut, fragment, Fragment.get(fragment, platform = None).prepare())
+			elaboratedDesigns[key] = design
+
+		self.dut = design.dut
+		self._frag = design.fragment
+		self.sim = _PreparedSimulator(design.prepared)
+
+		# The rest is as ToriiTestCase.setUp does it
+		if self.out_dir is None:
+			if (Path.cwd() / 'build').exists():
+				self.out_dir = Path.cwd() / 'build' / 'tests'
+			else:
+				self.out_dir = Path.cwd() / 'test-vcds'
+		self.out_dir.mkdir(exist_ok = True, parents = True)
+
+		for domain, _ in self.domains:
+			self.sim.add_clock(self.clk_period(domain), domain = domain)
+
+	def run_sim(self, *, suffix: str | None = None) -> None:
+		# If FSM coverage is requested, hook the simulation and store what it saw once it completes
+		coverageDirectory = getenv(coverageEnvironment)
+		if coverageDirectory is None:
+			super().run_sim(suffix = suffix)
+			return
+
+		coverage = FSMCoverage()
+		coverage.attach(self.sim, self._frag)
+		super().run_sim(suffix = suffix)
+		coverage.saveShard(Path(coverageDirectory))
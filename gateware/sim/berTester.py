@@ -0,0 +1,66 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from torii import Signal
+from . import SimulationTestCase
+from ..berTester import RegisterReadout
+
+registers = (Signal(32), Signal(32))
+divisor = 8
+
+class RegisterReadoutTestCase(SimulationTestCase):
+	dut : RegisterReadout = RegisterReadout
+	dut_args = {'registers': registers, 'divisor': divisor}
+	domains = (('sync', 12e6), )
+
+	def cycles(self, count):
+		for _ in range(count):
+			yield
+
+	def sendByte(self, value):
+		serial = self.dut.serial
+		cleared = False
+		# Start bit, data bits LSB first, then the stop bit
+		for bit in [0, *((value >> bit) & 1 for bit in range(8)), 1]:
+			yield serial.rx.i.eq(bit)
+			for _ in range(divisor):
+				yield
+				cleared |= bool((yield self.dut.clear))
+		# Let the receiver finish with the stop bit
+		for _ in range(divisor):
+			yield
+			cleared |= bool((yield self.dut.clear))
+		return cleared
+
+	def receiveByte(self):
+		serial = self.dut.serial
+		yield from self.wait_until_low(serial.tx.o, timeout = divisor * 20)
+		# Sample in the middle of each bit after the start bit
+		yield from self.cycles(divisor + divisor // 2)
+		value = 0
+		for bit in range(8):
+			value |= (yield serial.tx.o) << bit
+			yield from self.cycles(divisor)
+		assert (yield serial.tx.o) == 1
+		return value
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testReadout(self):
+		dut = self.dut
+		yield registers[0].eq(0x12345678)
+		yield registers[1].eq(0xcafef00d)
+		yield from self.cycles(divisor * 2)
+		# Ask for the second register, and check it comes back least significant byte first
+		assert not (yield from self.sendByte(1))
+		reply = []
+		for _ in range(4):
+			reply.append((yield from self.receiveByte()))
+		assert bytes(reply) == (0xcafef00d).to_bytes(4, byteorder = 'little')
+		# Out of range registers should get no answer
+		assert not (yield from self.sendByte(5))
+		for _ in range(divisor * 12):
+			assert (yield dut.serial.tx.o) == 1
+			yield
+		# And a byte with bit 7 set should clear the counters
+		assert (yield from self.sendByte(0x80))
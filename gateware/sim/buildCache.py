@@ -0,0 +1,62 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from ..buildCache import BuildCache
+from .fakeToolchain import fakeToolchain, buildPlan
+
+class BuildCacheTestCase(TestCase):
+	def setUp(self):
+		self.directory = TemporaryDirectory()
+		self.path = Path(self.directory.name)
+		self.log = self.path / 'tools.log'
+		self.environment = fakeToolchain(self.path, self.log)
+		self.environment.start()
+
+	def tearDown(self):
+		self.environment.stop()
+		self.directory.cleanup()
+
+	def build(self, rtlil: str, nextpnrOptions: str = '--seed=0'):
+		cache = BuildCache(buildPlan(rtlil, nextpnrOptions), 'test', buildDir = self.path / 'build')
+		return cache.execute()
+
+	def toolRuns(self):
+		runs = self.log.read_text().splitlines() if self.log.exists() else []
+		self.log.unlink(missing_ok = True)
+		return [run.split()[0] for run in runs]
+
+	def testCaching(self):
+		# A cold build runs everything
+		assert self.build('module a') == {'synthesis': False, 'place-and-route': False, 'bitstream': False}
+		assert self.toolRuns() == ['yosys', 'nextpnr-ice40', 'icepack']
+		# Doing it again should run nothing and still produce all the outputs
+		for output in (self.path / 'build').glob('test.*'):
+			if output.suffix in ('.json', '.asc', '.bin'):
+				output.unlink()
+		assert self.build('module a') == {'synthesis': True, 'place-and-route': True, 'bitstream': True}
+		assert self.toolRuns() == []
+		assert (self.path / 'build' / 'test.bin').read_text() == 'bitstream\n'
+		assert (self.path / 'build' / 'test.json').read_text() == 'netlist\n'
+
+	def testNextpnrOptions(self):
+		self.build('module a')
+		self.toolRuns()
+		# Changing just the nextpnr options should skip straight to place-and-route
+		hits = self.build('module a', '--seed=1 --write test.pnr.json')
+		assert hits == {'synthesis': True, 'place-and-route': False, 'bitstream': False}
+		assert self.toolRuns() == ['nextpnr-ice40', 'icepack']
+		# The extra `--write` output must be cached along with the rest of the place-and-route results
+		(self.path / 'build' / 'test.pnr.json').unlink()
+		self.build('module a', '--seed=1 --write test.pnr.json')
+		assert self.toolRuns() == []
+		assert (self.path / 'build' / 'test.pnr.json').exists()
+
+	def testDesignChange(self):
+		self.build('module a')
+		self.toolRuns()
+		# Changing the design must re-run the whole flow
+		self.build('module b')
+		assert self.toolRuns() == ['yosys', 'nextpnr-ice40', 'icepack']
@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from ..buildCache import BuildCache
+from ..buildMatrix import BuildVariant, loadMatrix, buildVariants
+from ..swo import SWOMode, Loopback
+from .fakeToolchain import fakeToolchain, buildPlan
+
+class BuildMatrixTestCase(TestCase):
+	def setUp(self):
+		self.directory = TemporaryDirectory()
+		self.path = Path(self.directory.name)
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def loadMatrix(self, matrix: str):
+		fileName = self.path / 'matrix.toml'
+		fileName.write_text(matrix)
+		return loadMatrix(fileName)
+
+	def testLoadMatrix(self):
+		variants = self.loadMatrix('\n'.join((
+			'[defaults]',
+			'mode = "continuous"',
+			'baud = 230400',
+			'[[variant]]',
+			'name = "default"',
+			'[[variant]]',
+			'name = "alt-pins"',
+			'swo-pin = 3',
+			'trigger-pin = "47"',
+			'loopback = "internal"',
+			'[[variant]]',
+			'name = "triggered"',
+			'mode = "triggered"',
+			'stimulus = "traces/trace.bin"',
+		)))
+		assert variants == (
+			BuildVariant('default', baudRate = 230400, mode = SWOMode.continuous),
+			BuildVariant('alt-pins', 230400, '3', '47', SWOMode.continuous, Loopback.internal),
+			BuildVariant('triggered', 230400, stimulus = self.path / 'traces' / 'trace.bin'),
+		)
+
+	def testInvalidMatrix(self):
+		for matrix, message in (
+			('', 'no variants defined'),
+			('[[variant]]\nbaud = 1', 'variant name None is not valid'),
+			('[[variant]]\nname = "a/b"', 'variant name \'a/b\' is not valid'),
+			('[[variant]]\nname = "a"\n[[variant]]\nname = "a"', 'variant a is defined more than once'),
+			('[[variant]]\nname = "a"\nspeed = 1', 'unknown setting \'speed\' for variant a'),
+			('[[variant]]\nname = "a"\nbaud = "fast"', 'baud for variant a must be a positive integer'),
+			('[defaults]\nmode = "sometimes"\n[[variant]]\nname = "a"', 'mode for variant defaults must be one of'),
+			('[[variant]]\nname = "a"\nloopback = "sideways"', 'loopback for variant a must be one of'),
+			('[[variant]]\nname = "a"\nswo-pin = "44"', 'variant a puts SWO and the trigger on the same pin'),
+			('[[variant]]\nname = "a"\nswo-pin = 45', 'swo-pin for variant a is pin 45, which loopback#0 already uses'),
+			('[[variant]]\nname = "a"\ntrigger-pin = "11"', 'trigger-pin for variant a is pin 11, which led#0 already uses'),
+			('[variants]\nname = "a"', 'unknown section \'variants\''),
+			('[[variant]\n', 'matrix.toml: '),
+		):
+			with self.subTest(matrix = matrix), self.assertRaisesRegex(ValueError, message):
+				self.loadMatrix(matrix)
+
+	def testSharedSynthesis(self):
+		log = self.path / 'tools.log'
+		builds = []
+		# Two variants with the same netlist but different pins, and one with a different netlist
+		for name, rtlil, pcf in (('a', 'module a', 'set_io swo 46\n'), ('b', 'module a', 'set_io swo 45\n'),
+			('c', 'module c', 'set_io swo 46\n')):
+			plan = buildPlan(rtlil, '--seed=0')
+			plan.files['test.pcf'] = pcf
+			cache = BuildCache(plan, 'test', self.path / 'variants' / name, self.path / 'cache')
+			builds.append((BuildVariant(name), cache))
+
+		with fakeToolchain(self.path, log):
+			results = buildVariants(builds, jobs = 2)
+			runs = [run.split()[0] for run in log.read_text().splitlines()]
+			# Synthesis only runs once per distinct netlist, but everything gets placed and routed
+			assert sorted(runs) == ['icepack'] * 3 + ['nextpnr-ice40'] * 3 + ['yosys'] * 2
+			assert [result.sharedWith for result in results] == [None, 'a', None]
+			assert all(result.error is None and not result.cached for result in results)
+			for result in results:
+				assert (result.buildDir / 'test.bin').read_text() == 'bitstream\n'
+
+			# And building again should come entirely from the cache
+			log.unlink()
+			results = buildVariants(builds, jobs = 2)
+			assert not log.exists()
+			assert all(result.cached for result in results)
@@ -0,0 +1,80 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from json import dump
+from torii.build.run import BuildPlan
+from ..buildReport import addStatisticsScript, buildSummary, compareSummaries
+
+# Cut down versions of what nextpnr's `--report` and Yosys's `stat -json` write out
+report = {
+	'fmax': {'cd_sync.clk': {'achieved': 60.0, 'constraint': 12.0}},
+	'utilization': {
+		'ICESTORM_LC': {'used': 176, 'available': 5280},
+		'ICESTORM_RAM': {'used': 0, 'available': 30},
+	},
+	'critical_paths': [],
+}
+statistics = {
+	'modules': {
+		'\\test': {'num_cells_by_type': {'SB_LUT4': 10, 'SB_DFFR': 4, 'SB_DFFE': 2}},
+		'\\test.encoder': {'num_cells_by_type': {'SB_LUT4': 5, 'SB_CARRY': 3, 'SB_RAM40_4K': 1}},
+		'\\test.pin_swo_0': {'num_cells_by_type': {'SB_IO': 1}},
+		'\\test.cd_sync': {'num_cells_by_type': {'SB_GB': 1}},
+	},
+}
+
+def summary(fmax: float = 60.0, luts: int = 176):
+	return {
+		'design': 'test',
+		'fmax': {'cd_sync.clk': {'achieved': fmax, 'constraint': 12.0, 'slack': 0}},
+		'utilisation': {'ICESTORM_LC': {'used': luts, 'available': 5280}},
+	}
+
+class BuildReportTestCase(TestCase):
+	def testStatisticsScript(self):
+		plan = BuildPlan(script = 'build_test')
+		plan.add_file('test.ys', 'read_rtlil test.il\nsynth_ice40 -abc9 -top test\nwrite_json test.json\n')
+		addStatisticsScript(plan, 'test')
+		assert plan.files['test.stat.ys'] == (
+			'read_rtlil test.il\nsynth_ice40 -noflatten -abc9 -top test\ntee -q -o test.stat.json stat -json\n'
+		)
+
+	def testSummary(self):
+		with TemporaryDirectory() as directory:
+			buildDir = Path(directory)
+			with (buildDir / 'test.report.json').open('w') as file:
+				dump(report, file)
+			# Without the statistics there should be no per-module breakdown
+			result = buildSummary(buildDir, 'test')
+			assert 'modules' not in result
+			assert result['utilisation']['ICESTORM_LC'] == {'used': 176, 'available': 5280}
+			timing = result['fmax']['cd_sync.clk']
+			assert timing['achieved'] == 60.0
+			assert abs(timing['slack'] - ((1000 / 12) - (1000 / 60))) < 1e-9
+
+			with (buildDir / 'test.stat.json').open('w') as file:
+				dump(statistics, file)
+			modules = buildSummary(buildDir, 'test')['modules']
+			assert set(modules) == {'test', 'test.encoder'}
+			assert modules['test'] == {'luts': 10, 'ffs': 6, 'carries': 0, 'brams': 0, 'dsps': 0, 'sprams': 0}
+			assert modules['test.encoder'] == {'luts': 5, 'ffs': 0, 'carries': 3, 'brams': 1, 'dsps': 0, 'sprams': 0}
+
+	def testCompare(self):
+		assert compareSummaries(summary(), summary()) == []
+		# A small Fmax drop is within the default tolerance, a large one is not
+		changes = compareSummaries(summary(), summary(fmax = 58.0))
+		assert [(change.metric, change.regression) for change in changes] == [('fmax cd_sync.clk', False)]
+		changes = compareSummaries(summary(), summary(fmax = 50.0))
+		assert [(change.metric, change.regression) for change in changes] == [('fmax cd_sync.clk', True)]
+		# Any area growth is a regression by default, but may be tolerated
+		changes = compareSummaries(summary(), summary(luts = 180))
+		assert changes[0].regression
+		assert abs(changes[0].change - (4 / 176 * 100)) < 1e-9
+		assert not compareSummaries(summary(), summary(luts = 180), areaTolerance = 5)[0].regression
+		assert not compareSummaries(summary(), summary(luts = 170))[0].regression
+		# Failing timing is always a regression, even against a baseline that also failed
+		changes = compareSummaries(summary(fmax = 10.0), summary(fmax = 11.0))
+		assert [(change.metric, change.regression) for change in changes] == [('fmax cd_sync.clk', True)]
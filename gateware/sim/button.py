@@ -1,15 +1,15 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
 # SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
-from torii.test import ToriiTestCase
+from . import SimulationTestCase
 from ..button import Button
 
-class ButtonTestCase(ToriiTestCase):
+class ButtonTestCase(SimulationTestCase):
 	dut : Button = Button
 	domains = (('sync', 12e6), )
 
-	@ToriiTestCase.simulation
-	@ToriiTestCase.sync_domain(domain = 'sync')
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
 	def testDebouncing(self):
 		dut = self.dut
 		# Set the input up and run till the first sampling point
@@ -0,0 +1,115 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from pathlib import Path
+import numpy as np
+from ..captureDecoder import decodeCapture, parseSamplerate, sampleRuns, sigrokBinaryChunks, vcdRuns
+from ..itm import ITMPacketKind
+from ..stimulus import itmStreamPackets
+from ..vcd import VCDFile
+
+expected = list(itmStreamPackets())
+
+def manchesterHalfBits(frames: list[bytes]) -> np.ndarray:
+	# Start bit, data bits LSB first with a 1 sent as high then low, then the stop bit
+	halfBits = []
+	for frame in frames:
+		bits = np.unpackbits(np.frombuffer(frame, dtype = np.uint8), bitorder = 'little')
+		halfBits += [1, 0]
+		for bit in bits:
+			halfBits += [bit, 1 - bit]
+		halfBits += [0, 0]
+	return np.array(halfBits, dtype = np.uint8)
+
+def manchesterSamples(frames: list[bytes], sampleRate: float, baudRate: float) -> np.ndarray:
+	halfBits = manchesterHalfBits(frames)
+	edges = np.rint(np.arange(len(halfBits) + 1) * sampleRate / (2 * baudRate)).astype(np.int64)
+	# Idle the line a while either side of the frames
+	return np.concatenate((
+		np.zeros(100, dtype = np.uint8), np.repeat(halfBits, np.diff(edges)), np.zeros(100, dtype = np.uint8)
+	))
+
+class CaptureDecoderTestCase(TestCase):
+	def decodeSamples(self, samples: np.ndarray, chunkSize: int = 4096, sampleRate: float = 12e6):
+		with TemporaryDirectory() as directory:
+			fileName = Path(directory) / 'capture.bin'
+			# Put the SWO line on channel 2 of the capture with noise on the other channels
+			noise = np.random.default_rng(0).integers(0, 256, len(samples), dtype = np.uint8) & 0xfb
+			(noise | (samples << 2)).tofile(fileName)
+			runs = sampleRuns(sigrokBinaryChunks(fileName, 2, 1, chunkSize))
+			return decodeCapture(runs, sampleRate, 115200, expected)
+
+	def testClean(self):
+		# Start part way through the stream, and run at a slightly fast baud rate
+		frames = (expected * 3)[5:150]
+		report = self.decodeSamples(manchesterSamples(frames, 12e6, 116000))
+		assert report.frames == len(frames)
+		assert report.errors == 0
+		assert report.packets == {ITMPacketKind.instrumentation: len(frames)}
+		assert report.ports == {0: len(frames)}
+		assert abs(report.baudRate - 116000) < 100
+		# How the capture is split into chunks must not change the result
+		chunked = self.decodeSamples(manchesterSamples(frames, 12e6, 116000), chunkSize = 97)
+		assert chunked == report
+
+	def testErrors(self):
+		frames = expected[:40]
+		# Corrupt one bit of one frame's payload, and lose another frame entirely
+		frames[10] = bytes((0x01, frames[10][1] ^ 0x10))
+		del frames[20]
+		report = self.decodeSamples(manchesterSamples(frames, 12e6, 115200))
+		assert report.frames == 39
+		assert report.bitErrors == 1
+		assert report.missingFrames == 1
+		assert report.violations == 0
+
+		# Now hold the line high through the middle of a bit so it loses its mid-bit transition
+		samples = manchesterSamples(expected[:10], 12e6, 115200)
+		halfBit = 12e6 / (2 * 115200)
+		frameStart = int(100 + 36 * halfBit * 5)
+		samples[frameStart + int(halfBit * 4):frameStart + int(halfBit * 6)] = 1
+		report = self.decodeSamples(samples)
+		assert report.violations > 0
+		assert report.frames == 9
+
+	def decodeVCD(self, frames: list[bytes], startTime: int):
+		# Build a VCD of the line as the simulator would dump it, with a 1ps timescale, starting the first frame at
+		# startTime into the simulation
+		halfBits = manchesterHalfBits(frames)
+		halfBitPeriod = round(1e12 / (2 * 115200))
+		lines = ['$timescale 1 ps $end', '$scope module top $end', '$var wire 1 ! swo__swo__o $end',
+			'$upscope $end', '$enddefinitions $end', '#0', '0!']
+		previous = 0
+		for index, level in enumerate(halfBits):
+			if level != previous:
+				lines += [f'#{startTime + index * halfBitPeriod}', f'{level}!']
+				previous = level
+		# Leave the line idle for a while before the simulation ends
+		lines.append(f'#{startTime + (len(halfBits) + 10) * halfBitPeriod}')
+		with TemporaryDirectory() as directory:
+			fileName = Path(directory) / 'capture.vcd'
+			fileName.write_text('\n'.join(lines) + '\n')
+			with VCDFile(fileName) as vcd:
+				sampleRate, runs = vcdRuns(vcd, 'swo.o', 16)
+				return decodeCapture(runs, sampleRate, 115200, expected)
+
+	def testVCD(self):
+		halfBitPeriod = round(1e12 / (2 * 115200))
+		report = self.decodeVCD(expected[:4], 10 * halfBitPeriod)
+		assert report.frames == 4
+		assert report.errors == 0
+
+		# The line sitting at its initial value for only a fraction of a bit before the first frame is just where the
+		# simulation happened to start, not a badly timed run
+		report = self.decodeVCD(expected[:4], halfBitPeriod // 3)
+		assert report.frames == 4
+		assert report.errors == 0
+
+	def testSamplerate(self):
+		assert parseSamplerate('24 MHz') == 24e6
+		assert parseSamplerate('500kHz') == 500e3
+		assert parseSamplerate('1000000') == 1e6
+		with self.assertRaises(ValueError):
+			parseSamplerate('fast')
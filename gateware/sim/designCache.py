@@ -0,0 +1,65 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest.mock import patch
+from torii.sim import Simulator
+from . import SimulationTestCase, elaboratedDesigns, _PreparedSimulator
+from ..manchester import ManchesterEncoder
+
+class Platform:
+	default_clk_frequency = 12e6
+
+class DesignCacheTestCase(SimulationTestCase):
+	dut : ManchesterEncoder = ManchesterEncoder
+	domains = (('sync', 12e6), )
+	platform = Platform
+
+	def testSharing(self):
+		assert elaboratedDesigns[self.designKey()].dut is self.dut
+		# Another test over the same DUT should get the same design, but its own simulator
+		other = DesignCacheTestCase('testSharing')
+		other.setUp()
+		assert other.dut is self.dut
+		assert other.sim is not self.sim
+
+		# Whereas building the DUT differently must get a different design
+		class FastTestCase(DesignCacheTestCase):
+			dut_args = {'baudRate': 1000000}
+		fast = FastTestCase('testSharing')
+		fast.setUp()
+		assert fast.dut is not self.dut
+		assert fast.dut.baudRate == 1000000
+
+	def testFallback(self):
+		assert isinstance(self.sim, _PreparedSimulator)
+		# With a version of Torii the prepared simulator isn't known to work with, every test elaborates its own DUT
+		_PreparedSimulator.supported.cache_clear()
+		try:
+			with patch('gateware.sim.toriiVersion', '0.8.0'), self.assertWarns(UserWarning):
+				other = DesignCacheTestCase('testFallback')
+				other.setUp()
+		finally:
+			_PreparedSimulator.supported.cache_clear()
+		assert other.dut is not self.dut
+		assert type(other.sim) is Simulator
+
+	def startFrame(self):
+		dut = self.dut
+		halfBitPeriod = int((1 / self.clk_period('sync')) // 115200) // 2
+		# Everything should be in its reset state, whatever the last simulation of this design left it in
+		assert (yield dut.manchesterOut) == 0
+		assert (yield dut.cycleComplete) == 0
+		yield from self.pulse_pos(dut.start)
+		yield from self.wait_until_high(dut.manchesterOut, timeout = halfBitPeriod * 3)
+		# Leave the encoder part way through sending a frame
+		yield from self.step(halfBitPeriod)
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testFirstSimulation(self):
+		yield from self.startFrame()
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testSecondSimulation(self):
+		yield from self.startFrame()
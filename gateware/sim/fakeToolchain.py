@@ -0,0 +1,54 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest.mock import patch
+from pathlib import Path
+from os import environ
+from torii.build.run import BuildPlan
+
+__all__ = (
+	'fakeToolchain',
+	'buildPlan',
+)
+
+# Stand-in for the toolchain that logs each invocation and writes out the files named by its arguments
+fakeTool = '''#!/bin/sh
+[ "$1" = "-V" ] || [ "$1" = "--version" ] && exit 0
+echo "$(basename "$0") $*" >> "$TOOL_LOG"
+while [ $# -gt 0 ]; do
+	case "$1" in
+		-l|--log|--asc|--write|--report) echo "$0" > "$2"; shift;;
+		*.ys) echo netlist > test.json;;
+		*.asc) [ -n "$2" ] && echo bitstream > "$2"; shift;;
+	esac
+	shift
+done
+'''
+
+def fakeToolchain(path: Path, log: Path):
+	# Write out the fake tools into path, and return a patch of the environment that points the build scripts at
+	# them and has them log each run to log
+	tools = {}
+	for tool, variable in (('yosys', 'YOSYS'), ('nextpnr-ice40', 'NEXTPNR_ICE40'), ('icepack', 'ICEPACK')):
+		script = path / tool
+		script.write_text(fakeTool)
+		script.chmod(0o755)
+		tools[variable] = str(script)
+	return patch.dict(environ, {**tools, 'TOOL_LOG': str(log)})
+
+def buildPlan(rtlil: str, nextpnrOptions: str) -> BuildPlan:
+	plan = BuildPlan(script = 'build_test')
+	plan.add_file('build_test.sh', '\n'.join((
+		'#!/bin/sh',
+		'set -e',
+		': ${YOSYS:=yosys}',
+		': ${NEXTPNR_ICE40:=nextpnr-ice40}',
+		': ${ICEPACK:=icepack}',
+		'"$YOSYS" -q -l test.rpt test.ys',
+		f'"$NEXTPNR_ICE40" --quiet {nextpnrOptions} --log test.tim --json test.json --pcf test.pcf --asc test.asc',
+		'"$ICEPACK" test.asc test.bin',
+	)))
+	plan.add_file('test.il', rtlil)
+	plan.add_file('test.ys', 'read_rtlil test.il\nsynth_ice40 -abc9 -top test\nwrite_json test.json\n')
+	plan.add_file('test.pcf', 'set_io swo 46\n')
+	return plan
@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from torii.hdl.ir import Fragment
+from torii.sim import Simulator
+from . import SimulationTestCase
+from .swo import Platform as SWOPlatform
+from ..fsmCoverage import FSMCoverage, findFSMs
+from ..manchester import ManchesterEncoder
+from ..swo import SWO
+
+class Platform:
+	default_clk_frequency = 12e6
+
+class FSMCoverageTestCase(SimulationTestCase):
+	dut : ManchesterEncoder = ManchesterEncoder
+	domains = (('sync', 12e6), )
+	platform = Platform
+
+	def setUp(self):
+		super().setUp()
+		self.coverage = FSMCoverage()
+		self.coverage.attach(self.sim, self._frag)
+
+	def testDiscovery(self):
+		fsms = {fsm.name: fsm for fsm in findFSMs(Fragment.get(SWO(), SWOPlatform()))}
+		assert set(fsms) == {'swo.swo', 'manchester.manchester'}
+		assert list(fsms['swo.swo'].states.values()) == ['IDLE', 'START', 'TRANSMIT', 'STOP']
+		assert fsms['swo.swo'].transitions == {
+			('IDLE', 'START'), ('START', 'TRANSMIT'), ('TRANSMIT', 'STOP'), ('STOP', 'START'), ('STOP', 'IDLE')
+		}
+		assert ('STOP_BIT', 'START_BIT') in fsms['manchester.manchester'].transitions
+		assert ('STOP_BIT', 'IDLE') in fsms['manchester.manchester'].transitions
+
+	def testUnhookableSimulator(self):
+		# A simulator without the engine internals coverage hooks into must be refused, not silently ignored
+		simulator = Simulator(Fragment.get(ManchesterEncoder(), Platform()))
+		del simulator._engine._processes
+		with self.assertRaisesRegex(RuntimeError, 'the simulator has no _engine._processes'):
+			FSMCoverage().attach(simulator, self._frag)
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testStatesRecorded(self):
+		dut = self.dut
+		# Starting the encoder must get seen moving it out of its reset state
+		yield from self.pulse_pos(dut.start)
+		yield from self.step(4)
+		self.coverage.collect()
+		visits = self.coverage.visits['manchester.manchester']
+		assert visits.get('IDLE', 0) >= 1
+		assert visits.get('WAIT_START', 0) >= 1
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testImmediateRestart(self):
+		dut = self.dut
+		halfBitPeriod = int((1 / self.clk_period('sync')) // 115200) // 2
+		# Start the encoder and let it get a couple of bits out
+		yield from self.pulse_pos(dut.start)
+		yield from self.step(halfBitPeriod * 8)
+		# Ask for a stop bit and hold start high across it so the encoder must immediately restart
+		yield from self.pulse_pos(dut.stop)
+		yield dut.start.eq(1)
+		yield from self.step(halfBitPeriod * 6)
+		yield dut.start.eq(0)
+		# Then let it stop for real
+		yield from self.pulse_pos(dut.stop)
+		yield from self.step(halfBitPeriod * 6)
+
+		self.coverage.collect()
+		visits = self.coverage.visits['manchester.manchester']
+		transitions = self.coverage.transitions['manchester.manchester']
+		assert set(visits) == {'IDLE', 'WAIT_START', 'START_BIT', 'BIT_ENCODE', 'STOP_BIT'}
+		assert transitions == {
+			'IDLE->WAIT_START': 1,
+			'WAIT_START->START_BIT': 1,
+			'START_BIT->BIT_ENCODE': 2,
+			'BIT_ENCODE->STOP_BIT': 2,
+			'STOP_BIT->START_BIT': 1,
+			'STOP_BIT->IDLE': 1,
+		}
+		assert self.coverage.report() == ['manchester.manchester (manchester.py:74): 5/5 states, 6/6 transitions']
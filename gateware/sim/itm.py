@@ -0,0 +1,42 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest import TestCase
+from ..itm import ITMPacketKind, ITMPacket, ITMParser
+
+class ITMParserTestCase(TestCase):
+	def testPackets(self):
+		parser = ITMParser()
+		packets = parser.feed(bytes((
+			# Synchronisation packet
+			0x00, 0x00, 0x00, 0x00, 0x00, 0x80,
+			# SWIT packets of 1, 2 and 4 bytes on ports 0, 1 and 31
+			0x01, 0x41,
+			0x0a, 0x34, 0x12,
+			0xfb, 0x78, 0x56, 0x34, 0x12,
+			# Overflow, then a local timestamp with 2 continuation bytes and a single byte one
+			0x70, 0xc0, 0x81, 0x01, 0x30,
+			# Hardware source packet from the DWT
+			0x05, 0x2a,
+		)))
+		assert packets == [
+			ITMPacket(ITMPacketKind.sync, None, bytes((0x00, 0x00, 0x00, 0x00, 0x00, 0x80))),
+			ITMPacket(ITMPacketKind.instrumentation, 0, b'\x01A'),
+			ITMPacket(ITMPacketKind.instrumentation, 1, bytes((0x0a, 0x34, 0x12))),
+			ITMPacket(ITMPacketKind.instrumentation, 31, bytes((0xfb, 0x78, 0x56, 0x34, 0x12))),
+			ITMPacket(ITMPacketKind.overflow, None, b'\x70'),
+			ITMPacket(ITMPacketKind.localTimestamp, None, bytes((0xc0, 0x81, 0x01))),
+			ITMPacket(ITMPacketKind.localTimestamp, None, b'\x30'),
+			ITMPacket(ITMPacketKind.hardware, 0, bytes((0x05, 0x2a))),
+		]
+		assert packets[2].payload == bytes((0x34, 0x12))
+
+	def testSplitPackets(self):
+		parser = ITMParser()
+		# Packets split across calls must be held over until the rest arrives
+		assert parser.feed(bytes((0x03, 0x01))) == []
+		assert parser.feed(bytes((0x02, 0x03))) == []
+		assert parser.feed(bytes((0x04, 0x94, 0x81))) == [
+			ITMPacket(ITMPacketKind.instrumentation, 0, bytes((0x03, 0x01, 0x02, 0x03, 0x04)))
+		]
+		assert parser.feed(bytes((0x02, ))) == [ITMPacket(ITMPacketKind.globalTimestamp, None, bytes((0x94, 0x81, 0x02)))]
@@ -2,19 +2,20 @@
 # SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
 # SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
 from torii.sim import Settle
-from torii.test import ToriiTestCase
-from ..manchester import ManchesterEncoder
+from . import SimulationTestCase
+from ..manchester import ManchesterEncoder, ManchesterDecoder
+from .captureDecoder import manchesterHalfBits
 
 class Platform:
 	default_clk_frequency = 12e6
 
-class ManchesterEncoderTestCase(ToriiTestCase):
+class ManchesterEncoderTestCase(SimulationTestCase):
 	dut : ManchesterEncoder = ManchesterEncoder
 	domains = (('sync', 12e6), )
 	platform = Platform
 
-	@ToriiTestCase.simulation
-	@ToriiTestCase.sync_domain(domain = 'sync')
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
 	def testEncoding(self):
 		dut = self.dut
 		halfBitPeriod = int((1 / self.clk_period('sync')) // 115200) // 2
@@ -65,3 +66,73 @@ class ManchesterEncoderTestCase(ToriiTestCase):
 		yield from self.wait_until_high(dut.halfBitComplete, timeout = halfBitPeriod)
 		assert (yield dut.manchesterOut) == 0
 		yield from self.step(50)
+
+class ManchesterDecoderTestCase(SimulationTestCase):
+	dut : ManchesterDecoder = ManchesterDecoder
+	domains = (('sync', 12e6), )
+	platform = Platform
+
+	def sendHalfBits(self, halfBits, received):
+		dut = self.dut
+		halfBitPeriod = int((1 / self.clk_period('sync')) // 115200) // 2
+		for halfBit in halfBits:
+			yield dut.manchesterIn.eq(int(halfBit))
+			for _ in range(halfBitPeriod):
+				yield
+				# Record everything the decoder tells us about as it happens
+				if (yield dut.dataValid):
+					received.append((yield dut.data))
+				if (yield dut.frameEnd):
+					received.append('end')
+				if (yield dut.frameError):
+					received.append('error')
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testDecoding(self):
+		received = []
+		# Idle the line then send a pair of clean frames
+		yield from self.sendHalfBits([0] * 5 + list(manchesterHalfBits([b'\x01A', bytes((0x0b, 0x78, 0x5a))])), received)
+		assert received == [0x01, 0x41, 'end', 0x0b, 0x78, 0x5a, 'end']
+
+		# Now hold the line high through the last bit so the frame has a code violation in it
+		received.clear()
+		halfBits = manchesterHalfBits([b'\x01C'])
+		halfBits[32:34] = 1
+		yield from self.sendHalfBits(list(halfBits) + [0] * 20, received)
+		assert received == [0x01, 'error']
+
+		# Then cut a frame off part way through a byte
+		received.clear()
+		halfBits = manchesterHalfBits([b'\x01D'])
+		yield from self.sendHalfBits(list(halfBits[:26]) + [0] * 20, received)
+		assert received == [0x01, 'error']
+
+		# And check that we pick back up cleanly after all that
+		received.clear()
+		yield from self.sendHalfBits(list(manchesterHalfBits([b'\x01E'])) + [0] * 4, received)
+		assert received == [0x01, 0x45, 'end']
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testMidStream(self):
+		received = []
+		# Start listening part way through a frame, just after the high half of the 1 bit at the start of the 0x01
+		# header and before the 0 bit that follows. That leaves the line low for a whole bit period before a rising
+		# edge, which must not be taken for the start of a frame. Frames go out back to back, so the first gap long
+		# enough to pick up from is after the frame ending in a 1 bit, and the rest follow on from their stop bits
+		halfBits = manchesterHalfBits([b'\x01A', b'\x01B', b'\x01\xc1', b'\x01C', b'\x01D'])
+		yield from self.sendHalfBits(list(halfBits[3:]) + [0] * 4, received)
+		# Nothing should come of the frames before the gap, and the frames after it should decode cleanly
+		assert received == [0x01, 0x43, 'end', 0x01, 0x44, 'end']
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testViolationRecovery(self):
+		received = []
+		# Send frames back to back, with a code violation in the second data byte of the middle one. There's no gap
+		# after it to pick back up from, so the decoder has to keep in step through to its stop bit
+		halfBits = manchesterHalfBits([b'\x01A', b'\x01B', b'\x01C'])
+		halfBits[36 + 22:36 + 24] = 1
+		yield from self.sendHalfBits([0] * 5 + list(halfBits) + [0] * 4, received)
+		assert received == [0x01, 0x41, 'end', 0x01, 'error', 0x01, 0x43, 'end']
@@ -0,0 +1,63 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest import TestCase
+from argparse import ArgumentTypeError
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from json import dump
+from ..buildCache import BuildCache
+from ..seedSweep import SeedResult, parseSeeds, timingSummary, bestSeed, _seedCommand, _placeAndRoute
+from .fakeToolchain import fakeToolchain, buildPlan
+
+class SeedSweepTestCase(TestCase):
+	def testParseSeeds(self):
+		assert parseSeeds('4') == [4]
+		assert parseSeeds('1-4') == [1, 2, 3, 4]
+		assert parseSeeds('1-3,7, 2-4') == [1, 2, 3, 7, 4]
+		assert parseSeeds('5,5,1-3,3-1000')[:6] == [5, 1, 2, 3, 4, 6]
+		for value in ('4-1', 'a', '1-', '-3'):
+			with self.assertRaises(ArgumentTypeError):
+				parseSeeds(value)
+
+	def testSeedCommand(self):
+		command = '"$NEXTPNR_ICE40" --quiet --tmg-ripup --seed=0 --up5k'
+		assert _seedCommand(command, 12) == '"$NEXTPNR_ICE40" --quiet --tmg-ripup --seed=12 --up5k'
+		assert _seedCommand('"$NEXTPNR_ICE40" --seed 3', 5) == '"$NEXTPNR_ICE40" --seed 5'
+		assert _seedCommand('"$NEXTPNR_ICE40" --up5k', 5) == '"$NEXTPNR_ICE40" --up5k --seed=5'
+
+	def testTimingSummary(self):
+		with TemporaryDirectory() as directory:
+			reportFile = Path(directory) / 'report.json'
+			with reportFile.open('w') as file:
+				dump({'fmax': {
+					'cd_sync.clk': {'achieved': 62.5, 'constraint': 12},
+					'cd_usb.clk': {'achieved': 50.0, 'constraint': 48},
+				}}, file)
+			fmax, constraint, slack = timingSummary(reportFile)
+			# The USB clock has the least slack so is the one reported
+			assert (fmax, constraint) == (50.0, 48)
+			self.assertAlmostEqual(slack, (1000 / 48) - 20)
+
+	def testBadTimingReport(self):
+		with TemporaryDirectory() as directory:
+			path = Path(directory)
+			# The fake nextpnr writes out junk for the timing report, so the seed should fail rather than raise
+			cache = BuildCache(buildPlan('module a', '--report test.report.json --seed=0'), 'test', path / 'build')
+			with fakeToolchain(path, path / 'tools.log'):
+				cache.execute(stages = ('synthesis', ))
+				result = _placeAndRoute(cache, 3, useCache = True)
+			assert result.seed == 3 and result.fmax is None
+			assert result.error.startswith('unreadable timing report: ')
+			assert bestSeed([result]) is None
+
+	def testBestSeed(self):
+		build = Path('build')
+		results = [
+			SeedResult(1, build, 60.0, 12, 66.0),
+			SeedResult(2, build, error = 'toolchain exited with status 1'),
+			SeedResult(3, build, 62.5, 12, 67.3),
+			SeedResult(4, build, 61.0, 12, 67.0),
+		]
+		assert bestSeed(results).seed == 3
+		assert bestSeed(results[1:2]) is None
@@ -0,0 +1,46 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest import TestCase, skipUnless
+from os import getenv
+from ..startupTime import (
+	ImportTime, StartupProfile, budgetEnvironment, startupBudgets, parseImportTimes, profileStartup
+)
+
+class StartupTimeTestCase(TestCase):
+	def testParseImportTimes(self):
+		imports = parseImportTimes('\n'.join((
+			'import time: self [us] | cumulative | imported package',
+			'import time:       131 |        247 | zipimport',
+			'import time:       412 |        412 |     torii.hdl.ast',
+			'import time:      1201 |       1613 |   torii',
+			'something else on stderr',
+			'import time:      3002 |       4615 | gateware.swo',
+		)))
+		assert imports == [
+			ImportTime('zipimport', 131, 247, 0),
+			ImportTime('torii.hdl.ast', 412, 412, 2),
+			ImportTime('torii', 1201, 1613, 1),
+			ImportTime('gateware.swo', 3002, 4615, 0),
+		]
+		profile = StartupProfile(('--help', ), 4.862, frozenset(entry.module for entry in imports))
+		assert profile.imported('torii')
+		assert not profile.imported('torii_boards')
+
+	def testImports(self):
+		# Each command line must keep clear of the packages it has no need for, which doesn't depend on timing
+		for budget in startupBudgets:
+			with self.subTest(arguments = budget.arguments):
+				profile = profileStartup(budget.arguments, runs = 1)
+				# Make sure we actually saw the imports happen
+				assert profile.imported('gateware')
+				for package in budget.forbidden:
+					assert not profile.imported(package), f'{package} imported'
+
+	@skipUnless(getenv(budgetEnvironment), f'startup time budgets are only checked with {budgetEnvironment} set')
+	def testBudgets(self):
+		# And start up within its budget
+		for budget in startupBudgets:
+			with self.subTest(arguments = budget.arguments):
+				profile = profileStartup(budget.arguments, runs = 3)
+				assert profile.importTime <= budget.budget, f'imports took {profile.importTime:.1f}ms'
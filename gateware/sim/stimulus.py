@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest import TestCase
+from unittest.mock import patch
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from ..stimulus import StimulusImage, itmStreamPackets
+
+class StimulusImageTestCase(TestCase):
+	def testDefault(self):
+		image = StimulusImage.default()
+		assert image.data[:4] == b'\x01A\x01B'
+		assert len(image.packets) == 64
+		assert image.packetData() == list(itmStreamPackets())
+		assert image.blocks == 1
+
+	def testValidation(self):
+		image = StimulusImage.fromStream(bytes((0x0b, 0x78, 0x56, 0x34, 0x12, 0x70, 0xc0, 0x81, 0x01)))
+		assert image.packets == (0, 5, 6)
+		with self.assertRaisesRegex(ValueError, 'is empty'):
+			StimulusImage.fromStream(b'')
+		with self.assertRaisesRegex(ValueError, 'part way through a packet at offset 2'):
+			StimulusImage.fromStream(bytes((0x01, 0x41, 0x02, 0x00)))
+		with self.assertRaisesRegex(ValueError, 'invalid packet header 0x04 at offset 2'):
+			StimulusImage.fromStream(bytes((0x01, 0x41, 0x04)))
+		# The stream has to fit into the EBR blocks available
+		stream = bytes((0x01, 0x41)) * 1024
+		assert StimulusImage.fromStream(stream).blocks == 4
+		with self.assertRaisesRegex(ValueError, 'needs 4 EBR blocks but only 3 are available'):
+			StimulusImage.fromStream(stream, blocks = 3)
+
+	def testCache(self):
+		with TemporaryDirectory() as directory:
+			path = Path(directory)
+			trace = path / 'trace.bin'
+			trace.write_bytes(bytes((0x03, 0x01, 0x02, 0x03, 0x04, 0x70)))
+			image = StimulusImage.fromFile(trace, path / 'cache')
+			assert image.packets == (0, 5)
+			# The second time through the stream should not need validating again
+			with patch.object(StimulusImage, 'fromStream', side_effect = AssertionError):
+				assert StimulusImage.fromFile(trace, path / 'cache') == image
+			# But changing the trace must
+			trace.write_bytes(bytes((0x70, 0x03, 0x01, 0x02, 0x03, 0x04)))
+			assert StimulusImage.fromFile(trace, path / 'cache').packets == (0, 1)
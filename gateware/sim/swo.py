@@ -2,9 +2,15 @@
 # SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
 # SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
 from torii import Record
-from torii.test import ToriiTestCase
+from . import SimulationTestCase
 from torii.hdl.rec import DIR_FANOUT, DIR_FANIN
-from ..swo import SWO
+import numpy as np
+from ..swo import SWO, SWOMode, Loopback
+from ..itm import ITMPacketKind
+from ..stimulus import StimulusImage
+from ..tpiu import TPIUFormatter, frameBytes, frameSync
+from ..captureDecoder import ManchesterDecoder, decodeCapture, sampleRuns
+from .tpiu import TPIUDeformatter, checkTrace, sources as tpiuSources
 
 swo = Record((
 	('swo', [
@@ -27,28 +33,52 @@ led1 = Record((
 	('o', 1, DIR_FANOUT),
 ))
 
+led2 = Record((
+	('o', 1, DIR_FANOUT),
+))
+
+led3 = Record((
+	('o', 1, DIR_FANOUT),
+))
+
+loopback = Record((
+	('i', 1, DIR_FANIN),
+))
+
+uart = Record((
+	('rx', [
+		('i', 1, DIR_FANIN),
+	]),
+	('tx', [
+		('o', 1, DIR_FANOUT),
+	]),
+))
+
 class Platform:
 	default_clk_frequency = 12e6
 
 	def request(self, name, number):
-		assert name in ('swo', 'button', 'led')
+		assert name in ('swo', 'button', 'led', 'loopback', 'uart')
+		assert number == 0 or name == 'led'
 		if name == 'swo':
-			assert number == 0
 			return swo
 		elif name == 'button':
-			assert number == 0
 			return button
 		elif name == 'led':
-			assert number == 0 or number == 1
-			return led0 if number == 0 else led1
+			assert number in range(4)
+			return (led0, led1, led2, led3)[number]
+		elif name == 'loopback':
+			return loopback
+		elif name == 'uart':
+			return uart
 
-class SWOTestCase(ToriiTestCase):
+class SWOTestCase(SimulationTestCase):
 	dut : SWO = SWO
 	domains = (('sync', 12e6), )
 	platform = Platform()
 
-	@ToriiTestCase.simulation
-	@ToriiTestCase.sync_domain(domain = 'sync')
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
 	def testContinuous(self):
 		halfBitPeriod = int((1 / self.clk_period('sync')) // 115200) // 2
 		# Tell the gateware to switch into continuous mode
@@ -172,8 +202,8 @@ class SWOTestCase(ToriiTestCase):
 			yield
 		assert (yield led0.o) == 1
 
-	@ToriiTestCase.simulation
-	@ToriiTestCase.sync_domain(domain = 'sync')
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
 	def testTriggered(self):
 		halfBitPeriod = int((1 / self.clk_period('sync')) // 115200) // 2
 		# Make sure we are in triggered mode and then trigger the opening sequence
@@ -313,3 +343,174 @@ class SWOTestCase(ToriiTestCase):
 		yield from self.step(halfBitPeriod - 1)
 		assert (yield led0.o) == 0
 		assert (yield swo.swo.o) == 0
+
+# A mix of packet lengths and kinds: a 4 byte SWIT on port 1, an overflow, a local timestamp with continuation
+# bytes, a synchronisation packet and a 2 byte hardware source packet
+stimulus = StimulusImage.fromStream(bytes((
+	0x0b, 0x78, 0x56, 0x34, 0x12,
+	0x70,
+	0xc0, 0x81, 0x01,
+	0x00, 0x00, 0x00, 0x00, 0x00, 0x80,
+	0x0e, 0x34, 0x12,
+)))
+
+class SWOStimulusTestCase(SimulationTestCase):
+	dut : SWO = SWO
+	dut_args = {'stimulus': stimulus}
+	domains = (('sync', 12e6), )
+	platform = Platform()
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testPackets(self):
+		# Switch into continuous mode
+		yield button.i.eq(1)
+		yield from self.step((2**7) * 4)
+		yield
+		yield button.i.eq(0)
+		yield from self.step(((2**7) * 4) + 8)
+		assert (yield led1.o) == 1
+		# Capture the SWO output for a little over two passes through the stimulus
+		samples = []
+		for _ in range(35000):
+			samples.append((yield swo.swo.o))
+			yield
+		# And check that every packet made it out intact, each in a frame of its own
+		runs = sampleRuns([np.array(samples, dtype = np.uint8)])
+		report = decodeCapture(runs, 12e6, 115200, stimulus.packetData())
+		assert report.errors == 0
+		assert report.frames == 10
+		assert report.packets == {
+			ITMPacketKind.instrumentation: 2, ITMPacketKind.overflow: 2, ITMPacketKind.localTimestamp: 2,
+			ITMPacketKind.sync: 2, ITMPacketKind.hardware: 2,
+		}
+		assert report.ports == {1: 2}
+
+class SWOLoopbackTestCase(SimulationTestCase):
+	dut : SWO = SWO
+	dut_args = {'loopback': Loopback.external}
+	domains = (('sync', 12e6), )
+	platform = Platform()
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testErrorInjection(self):
+		bitPeriod = int((1 / self.clk_period('sync')) // 115200)
+		# Every packet in the default stimulus is 2 bytes, so every frame is a start bit, 16 data bits and a stop bit
+		frameBits = 18
+		berTester = self.dut.berTester
+		# Switch into continuous mode
+		yield button.i.eq(1)
+		yield from self.step((2**7) * 4)
+		yield
+		yield button.i.eq(0)
+		yield from self.step(((2**7) * 4) + 8)
+		assert (yield led1.o) == 1
+
+		# Code violations to put in the stream, holding the line high for a whole bit, as (frame, bit) where bit 0
+		# is the start bit - in the last data bit, the first data bit and a data bit in the middle of a frame
+		violations = {(6, 16), (9, 1), (12, 9)}
+		# Loop the SWO output back round, tracking where each frame starts so we can damage specific bits
+		frame = -1
+		frameCycle = frameBits * bitPeriod
+		previous = 0
+		for _ in range(frameBits * bitPeriod * 16):
+			line = yield swo.swo.o
+			# SWO idles low and each frame begins with the line going high for its start bit
+			if frameCycle >= frameBits * bitPeriod and line and not previous:
+				frame += 1
+				frameCycle = 0
+			previous = line
+			bit = frameCycle // bitPeriod
+			# Flip the sense of bit 5 of the 3rd frame
+			if frame == 3 and bit == 6:
+				line ^= 1
+			elif (frame, bit) in violations:
+				line = 1
+			yield loopback.i.eq(line)
+			yield
+			frameCycle += 1
+			# Once a couple of frames have gone by clean, we should be locked and happy
+			if frame == 2 and frameCycle == 1:
+				assert (yield berTester.locked) == 1
+				assert (yield berTester.errors) == 0
+				assert (yield led3.o) == 1
+				assert (yield led2.o) == 0
+
+		# The bad bit should have been seen as just that, and each bad frame should only have counted once
+		assert (yield berTester.bitErrors) == 1
+		assert (yield berTester.frameErrors) == 3
+		assert (yield berTester.locked) == 1
+		# The first frame locks the tester and the frame after each bad one re-locks it, so none of those count
+		assert (yield berTester.frames) == 9
+		# Those frames are all checked, as is the first byte of the two bad frames with a violation in the second
+		assert (yield berTester.bitsChecked) == 9 * 16 + 16
+		assert (yield led2.o) == 1
+		assert (yield led3.o) == 0
+
+class SWOInternalLoopbackTestCase(SimulationTestCase):
+	dut : SWO = SWO
+	dut_args = {'loopback': Loopback.internal}
+	domains = (('sync', 12e6), )
+	platform = Platform()
+	# How many frames to check
+	frameCount = 20
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testLocking(self):
+		dut = self.dut
+		berTester = dut.berTester
+		# Frames go out back to back, each a start bit, 16 data bits and a stop bit
+		frameCycles = int((1 / self.clk_period('sync')) // dut.baudRate) * 18
+		# Start off in triggered mode, as the gateware does, so the line is idle when we switch into continuous mode
+		assert (yield berTester.locked) == 0
+		yield button.i.eq(1)
+		yield from self.step((2**7) * 4)
+		yield
+		yield button.i.eq(0)
+		yield from self.step(((2**7) * 4) + 8)
+		assert (yield led1.o) == 1
+		# The tester should lock onto the first frame, and then stay locked with no gaps between the frames after
+		yield from self.step(frameCycles * 2)
+		assert (yield berTester.locked) == 1
+		yield from self.step(frameCycles * self.frameCount)
+		assert (yield berTester.locked) == 1
+		assert (yield berTester.frames) >= self.frameCount
+		assert (yield berTester.frameErrors) == 0
+		assert (yield berTester.bitErrors) == 0
+		assert (yield berTester.errors) == 0
+
+class SWOFastLoopbackTestCase(SWOInternalLoopbackTestCase):
+	dut_args = {'loopback': Loopback.internal, 'baudRate': 1000000}
+	frameCount = 200
+
+formatter = TPIUFormatter(tpiuSources, switchInterval = 3, syncInterval = 2)
+
+class SWOTPIUTestCase(SimulationTestCase):
+	dut : SWO = SWO
+	dut_args = {'tpiu': formatter, 'mode': SWOMode.continuous}
+	domains = (('sync', 12e6), )
+	platform = Platform()
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testFrames(self):
+		# Capture the SWO output for long enough to see a couple of rounds of synchronisation packet and frames
+		samples = []
+		for _ in range(50000):
+			samples.append((yield swo.swo.o))
+			yield
+		decoder = ManchesterDecoder(12e6 / (2 * 115200), maxFrameBits = frameBytes * 8)
+		frames = []
+		for levels, durations, partial in sampleRuns([np.array(samples, dtype = np.uint8)]):
+			frames.extend(decoder.feedRuns(levels, durations, partial))
+		assert decoder.violations == 0
+		assert decoder.framingErrors == 0
+		# Each synchronisation packet and TPIU frame should go out as an SWO frame of its own
+		assert [len(frame) for frame in frames] == [len(frameSync), frameBytes, frameBytes, len(frameSync), frameBytes]
+		deformatter = TPIUDeformatter()
+		deformatter.feed(b''.join(frames))
+		assert deformatter.syncs == 2
+		assert deformatter.frames == 3
+		checkTrace(deformatter.trace, tpiuSources, formatter.switchInterval)
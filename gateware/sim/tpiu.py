@@ -0,0 +1,160 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from itertools import groupby
+from operator import itemgetter
+from torii.sim import Settle
+from . import SimulationTestCase
+from ..stimulus import StimulusImage
+from ..tpiu import TPIUFormatter, frameBytes, frameSync, maxSourceID
+
+class TPIUDeformatter:
+	'''
+	Reference TPIU deformatter.
+
+	Finds the frames in a formatted trace stream using the full frame synchronisation packets, then unpacks
+	each frame into the bytes sent by each trace source. Anything the formatter should never produce, such as
+	a reserved source ID or data before the first ID, is raised as a ValueError.
+	'''
+
+	def __init__(self) -> None:
+		self.buffer = bytearray()
+		self.synchronised = False
+		self.sourceID: int | None = None
+		self.frames = 0
+		self.syncs = 0
+		# Every byte of trace data, along with the ID of the source that sent it, in the order they were sent
+		self.trace: list[tuple[int, int]] = []
+
+	def feed(self, data: bytes) -> None:
+		self.buffer += data
+		while True:
+			if not self.synchronised:
+				index = self.buffer.find(frameSync)
+				if index == -1:
+					# Keep enough of the stream to spot a synchronisation packet split across calls
+					del self.buffer[:max(len(self.buffer) - (len(frameSync) - 1), 0)]
+					return
+				del self.buffer[:index + len(frameSync)]
+				self.synchronised = True
+				self.syncs += 1
+			elif self.buffer[:len(frameSync)] == frameSync:
+				del self.buffer[:len(frameSync)]
+				self.syncs += 1
+			elif len(self.buffer) >= frameBytes:
+				self.unpackFrame(bytes(self.buffer[:frameBytes]))
+				del self.buffer[:frameBytes]
+			else:
+				return
+
+	def unpackFrame(self, frame: bytes) -> None:
+		auxiliary = frame[-1]
+		for pair in range(frameBytes // 2):
+			value = frame[pair * 2]
+			moved = (auxiliary >> pair) & 1
+			# The last pair has no data byte of its own, that's where the auxiliary byte goes
+			following = frame[(pair * 2) + 1] if pair != (frameBytes // 2) - 1 else None
+			if value & 1:
+				sourceID = value >> 1
+				if sourceID > maxSourceID:
+					raise ValueError(f'Frame {self.frames} switches to reserved trace source ID 0x{sourceID:02x}')
+				# If the auxiliary bit is set, the data byte following still belongs to the old source
+				if moved and following is not None:
+					self.data(following)
+					following = None
+				self.sourceID = sourceID
+			else:
+				self.data(value | moved)
+			if following is not None:
+				self.data(following)
+		self.frames += 1
+
+	def data(self, value: int) -> None:
+		if self.sourceID is None:
+			raise ValueError(f'Frame {self.frames} contains trace data before any source ID')
+		# Source ID 0 is null data, which is just padding
+		if self.sourceID != 0:
+			self.trace.append((self.sourceID, value))
+
+def checkTrace(trace: list[tuple[int, int]], sources: tuple[StimulusImage, ...], switchInterval: int) -> None:
+	# Split the trace back up into the turns each source had, which should go round robin for switchInterval bytes
+	turns = [(sourceID, bytes(value for _, value in turn)) for sourceID, turn in groupby(trace, key = itemgetter(0))]
+	assert len(turns) > len(sources)
+	for index, (sourceID, turn) in enumerate(turns):
+		assert sourceID == (index % len(sources)) + 1
+		if index != len(turns) - 1:
+			assert len(turn) == switchInterval
+		else:
+			assert len(turn) <= switchInterval
+	# And each source should have sent its stimulus round and round, from the start
+	for index, image in enumerate(sources):
+		stream = b''.join(turn for sourceID, turn in turns if sourceID == index + 1)
+		repeats = -(-len(stream) // len(image.data))
+		assert stream == (image.data * repeats)[:len(stream)]
+
+# Three sources of different lengths, so that they wrap round at different points - the default character stream,
+# SWIT packets on port 1 with odd bytes in them and a mix of packet kinds
+sources = (
+	StimulusImage.default(),
+	StimulusImage.fromStream(bytes((0x0b, 0x78, 0x56, 0x34, 0x12, 0x09, 0xa5, 0x0a, 0xff, 0x01))),
+	StimulusImage.fromStream(bytes((
+		0x70,
+		0xc0, 0x81, 0x01,
+		0x00, 0x00, 0x00, 0x00, 0x00, 0x80,
+		0x0e, 0x34, 0x12,
+	))),
+)
+
+class TPIUFormatterTestCase(SimulationTestCase):
+	dut : TPIUFormatter = TPIUFormatter
+	dut_args = {'sources': sources, 'switchInterval': 5, 'syncInterval': 4}
+	domains = (('sync', 12e6), )
+	# How many bytes of formatted trace to check
+	byteCount = 20000
+
+	def readFormatter(self, count):
+		dut = self.dut
+		data = bytearray()
+		lengths = []
+		length = 0
+		# Pull bytes out as fast as the formatter allows, every other cycle
+		for _ in range(count):
+			yield
+			yield Settle()
+			data.append((yield dut.data))
+			length += 1
+			if (yield dut.last):
+				lengths.append(length)
+				length = 0
+			yield dut.advance.eq(1)
+			yield
+			yield dut.advance.eq(0)
+		return bytes(data), lengths
+
+	@SimulationTestCase.simulation
+	@SimulationTestCase.sync_domain(domain = 'sync')
+	def testFormatting(self):
+		dut = self.dut
+		data, lengths = yield from self.readFormatter(self.byteCount)
+		# Check the stream is made up of synchronisation packets, each followed by syncInterval frames
+		assert data.startswith(frameSync)
+		syncInterval = dut.syncInterval if dut.syncInterval else len(lengths)
+		for index, length in enumerate(lengths):
+			assert length == (len(frameSync) if index % (syncInterval + 1) == 0 else frameBytes)
+
+		deformatter = TPIUDeformatter()
+		# Feed the stream in chunks that don't line up with the frames
+		for offset in range(0, len(data), 1000):
+			deformatter.feed(data[offset:offset + 1000])
+		assert deformatter.syncs + deformatter.frames == len(lengths)
+		checkTrace(deformatter.trace, dut.sources, dut.switchInterval)
+
+class TPIUFormatterSwitchTestCase(TPIUFormatterTestCase):
+	# Switch sources as often as possible, which needs an ID change in every pair of bytes
+	dut_args = {'sources': sources[:2], 'switchInterval': 1, 'syncInterval': 0}
+	byteCount = 5000
+
+class TPIULongTurnTestCase(TPIUFormatterTestCase):
+	# Give each source turns longer than a frame
+	dut_args = {'sources': sources, 'switchInterval': 37, 'syncInterval': 1}
+	byteCount = 10000
@@ -0,0 +1,128 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from .. import compareVCDs
+from ..vcd import VCDFile, diffVCDs
+
+header = '''$timescale 1 ps $end
+$scope module bench $end
+$scope module top $end
+$var wire 1 ! clk $end
+$var wire 1 " swo__swo__o $end
+$var wire 1 & button__o $end
+$var wire 1 # manchesterOut $end
+$var wire 5 $ bit $end
+$scope module encoder $end
+$var wire 1 # manchesterOut $end
+$var string 1 % manchester_state $end
+$upscope $end
+$upscope $end
+$upscope $end
+$enddefinitions $end
+'''
+
+def generateVCD(divergeAt: int | None = None):
+	# 12 cycles of a 10ps clock with the SWO output toggling every 2 cycles and the bit counter counting cycles
+	lines = ['#0', '$dumpvars', '0!', '0"', '0#', 'b0 $', 'sIDLE/0 %', '$end']
+	for cycle in range(1, 13):
+		swo = (cycle // 2) & 1
+		if cycle == divergeAt:
+			swo ^= 1
+		lines += [f'#{cycle * 10}', '1!', f'{swo}"', f'{swo}#', f'b{cycle:b} $']
+		if cycle == 4:
+			lines.append('sSTART_BIT/2 %')
+		lines += [f'#{cycle * 10 + 5}', '0!']
+	return header + '\n'.join(lines) + '\n'
+
+class VCDTestCase(TestCase):
+	def setUp(self):
+		self.directory = TemporaryDirectory()
+		self.path = Path(self.directory.name)
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def writeVCD(self, name: str, divergeAt: int | None = None) -> Path:
+		fileName = self.path / name
+		fileName.write_text(generateVCD(divergeAt))
+		return fileName
+
+	def testLookup(self):
+		with VCDFile(self.writeVCD('lookup.vcd')) as vcd:
+			assert vcd.timescale == 1000
+			assert vcd.lookup('swo.o').name == 'bench.top.swo__swo__o'
+			assert vcd.lookup('bench.top.swo__swo__o').code == b'"'
+			# The top level and encoder copies of manchesterOut are the same signal so are not ambiguous
+			assert vcd.lookup('manchesterOut').name == 'bench.top.manchesterOut'
+			assert vcd.lookup('encoder.manchesterOut').code == b'#'
+			assert vcd.lookup('bit').width == 5
+			assert 'led0.o' not in vcd
+			with self.assertRaises(KeyError):
+				vcd.lookup('led0.o')
+			# A name that matches several different signals is there, but can't be looked up as it is
+			assert 'o' in vcd
+			with self.assertRaisesRegex(ValueError, 'ambiguous'):
+				vcd.lookup('o')
+
+	def testQueries(self):
+		with VCDFile(self.writeVCD('queries.vcd')) as vcd:
+			vcd.index('swo.o', 'bit', 'encoder.manchester_state')
+			assert list(vcd.changes('bit', 30, 50)) == [(30, '11'), (40, '100')]
+			assert vcd.valueAt('bit', 0) == '0'
+			assert vcd.valueAt('bit', 125) == '1100'
+			assert vcd.valueAt('encoder.manchester_state', 39) == 'IDLE/0'
+			assert vcd.valueAt('encoder.manchester_state', 40) == 'START_BIT/2'
+			assert vcd.valueAt('swo.o', 25) == '1'
+			assert vcd.cycleAt(0) == 0
+			assert vcd.cycleAt(40) == 3
+			assert vcd.cycleAt(41) == 4
+			assert vcd.endTime == 125
+
+	def testNoTimestamps(self):
+		fileName = self.path / 'untimed.vcd'
+		fileName.write_text(header + '$dumpvars\n0!\n0"\n$end\n')
+		with VCDFile(fileName) as vcd:
+			with self.assertRaisesRegex(ValueError, 'contains no timestamps'):
+				vcd.endTime
+			# Once there are changes indexed, their times are all there is to go on
+			vcd.index('clk')
+			assert vcd.endTime == 0
+
+	def testDiff(self):
+		with VCDFile(self.writeVCD('golden.vcd')) as golden:
+			with VCDFile(self.writeVCD('same.vcd')) as current:
+				results = diffVCDs(golden, current, ['swo.o', 'bit'])
+				assert results == {'swo.o': None, 'bit': None}
+
+			with VCDFile(self.writeVCD('diverged.vcd', divergeAt = 7)) as current:
+				results = diffVCDs(golden, current, ['swo.o', 'encoder.manchesterOut', 'bit'])
+				assert results['bit'] is None
+				divergence = results['swo.o']
+				assert divergence is not None
+				assert divergence.time == 70
+				assert divergence.cycle == 6
+				assert (divergence.golden, divergence.current) == ('1', '0')
+				assert results['encoder.manchesterOut'] == divergence.__class__(
+					'encoder.manchesterOut', 70, 6, '1', '0'
+				)
+
+	def testCompareErrors(self):
+		golden = self.path / 'golden'
+		current = self.path / 'current'
+		golden.mkdir()
+		current.mkdir()
+		for directory in (golden, current):
+			(directory / 'test.vcd').write_text(generateVCD())
+		# Bad files, missing files and ambiguous signals should all be reported as failures rather than raising
+		with self.assertLogs(level = 'ERROR') as logs:
+			assert compareVCDs(golden, current, ['o']) == 1
+			(current / 'empty.vcd').write_text('')
+			assert compareVCDs(golden / 'test.vcd', current / 'empty.vcd', ['swo.o']) == 1
+			assert compareVCDs(golden / 'missing.vcd', current / 'test.vcd', ['swo.o']) == 1
+		assert len(logs.records) == 3
+		assert 'ambiguous' in logs.records[0].getMessage()
+		assert 'empty' in logs.records[1].getMessage()
+		assert compareVCDs(golden, current, ['swo.o']) == 0
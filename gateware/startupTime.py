@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from dataclasses import dataclass
+from os import environ
+from pathlib import Path
+from subprocess import run, DEVNULL, PIPE
+import re
+import sys
+
+__all__ = (
+	'ImportTime',
+	'StartupBudget',
+	'StartupProfile',
+	'budgetEnvironment',
+	'startupBudgets',
+	'parseImportTimes',
+	'profileStartup',
+)
+
+@dataclass(frozen = True)
+class ImportTime:
+	module: str
+	# How long the module took to import by itself and including everything it imported, in microseconds
+	selfTime: int
+	cumulative: int
+	# How deeply nested the import was, 0 being imported directly by the script
+	depth: int
+
+@dataclass(frozen = True)
+class StartupBudget:
+	# Command line to run swoDebug.py with
+	arguments: tuple[str, ...]
+	# Most time the imports may take in total, in milliseconds
+	budget: float
+	# Top level packages that must not be imported to run the command line
+	forbidden: tuple[str, ...]
+
+@dataclass(frozen = True)
+class StartupProfile:
+	arguments: tuple[str, ...]
+	# Total time spent importing things, in milliseconds
+	importTime: float
+	# Every module imported
+	modules: frozenset[str]
+
+	def imported(self, package: str) -> bool:
+		return any(module == package or module.startswith(f'{package}.') for module in self.modules)
+
+# When set, the simulation tests also hold each command line to its startup time budget. That depends on how fast and
+# how busy the machine running them is, so is left to the `startup` action and to runs that opt in
+budgetEnvironment = 'SWO_STARTUP_BUDGETS'
+
+# Nothing that only needs the standard library may import the heavy dependencies, and only the build may import the
+# board files. The budgets leave a generous margin over how long things take on a typical machine so that they
+# catch imports that creep back in rather than the machine being busy
+heavyPackages = ('torii', 'torii_boards', 'rich', 'numpy')
+startupBudgets = (
+	StartupBudget(('--help', ), 80, heavyPackages),
+	StartupBudget(('sim', '--help'), 80, heavyPackages),
+	StartupBudget(('build', '--help'), 80, heavyPackages),
+	StartupBudget(('compare', '--summary', 'nonexistent.json'), 250, ('torii', 'torii_boards', 'numpy')),
+	StartupBudget(('diff', 'nonexistent', 'nonexistent', '-s', 'swo.o'), 250, ('torii', 'torii_boards', 'numpy')),
+	StartupBudget(('decode', 'nonexistent.sr'), 400, ('torii', 'torii_boards')),
+)
+
+# `python -X importtime` writes a line per import as `import time: <self> | <cumulative> | <indented name>`
+importTimePattern = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$', re.MULTILINE)
+
+def parseImportTimes(output: str) -> list[ImportTime]:
+	return [
+		ImportTime(match[4], int(match[1]), int(match[2]), (len(match[3]) - 1) // 2)
+		for match in importTimePattern.finditer(output)
+	]
+
+def profileStartup(arguments: tuple[str, ...], runs: int = 5) -> StartupProfile:
+	script = Path(__file__).resolve().parent.parent / 'swoDebug.py'
+	# Let Python cache the bytecode, as it normally would, so we're not timing compiling the modules too
+	environment = {name: value for name, value in environ.items() if name != 'PYTHONDONTWRITEBYTECODE'}
+	# Do a run to warm up the bytecode and disk caches, then take the quickest of the runs after that
+	times: list[float] = []
+	modules = frozenset()
+	for _ in range(runs + 1):
+		result = run(
+			[sys.executable, '-X', 'importtime', str(script), *arguments],
+			stdin = DEVNULL, stdout = DEVNULL, stderr = PIPE, env = environment, cwd = script.parent, text = True
+		)
+		imports = parseImportTimes(result.stderr)
+		times.append(sum(entry.cumulative for entry in imports if entry.depth == 0) / 1000)
+		modules = frozenset(entry.module for entry in imports)
+	return StartupProfile(arguments, min(times[1:]), modules)
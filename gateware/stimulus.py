@@ -0,0 +1,97 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from dataclasses import dataclass
+from hashlib import blake2b
+from json import dump, load
+from pathlib import Path
+from .itm import ITMPacketKind, ITMParser
+
+__all__ = (
+	'itmStreamData',
+	'itmStreamPackets',
+	'StimulusImage',
+	'ebrBytes',
+	'ebrBlocks',
+)
+
+# The iCE40UP5K has 30 4kib EBR blocks, which when 8 bits wide are 512 entries deep
+ebrBytes = 512
+ebrBlocks = 30
+
+def itmStreamData():
+	for char in range(ord('A'), ord('Z') + 1):
+		yield char
+	for char in range(ord('a'), ord('z') + 1):
+		yield char
+	for char in range(ord('0'), ord('9') + 1):
+		yield char
+	yield ord('\r')
+	yield ord('\n')
+
+def itmStreamPackets():
+	# Each character goes out as a 1 byte SWIT packet on stimulus port 0
+	for char in itmStreamData():
+		yield bytes((0x01, char))
+
+@dataclass(frozen = True)
+class StimulusImage:
+	# The packets back to back, exactly as they go out on the wire
+	data: bytes
+	# Offset into the data of the start of each packet
+	packets: tuple[int, ...]
+
+	@property
+	def blocks(self) -> int:
+		return -(-len(self.data) // ebrBytes)
+
+	def packetData(self) -> list[bytes]:
+		ends = (*self.packets[1:], len(self.data))
+		return [self.data[start:end] for start, end in zip(self.packets, ends)]
+
+	@classmethod
+	def fromStream(cls, stream: bytes, blocks: int = ebrBlocks) -> 'StimulusImage':
+		# Check the stream is nothing but whole ITM packets the SWO generator knows how to send, and that it fits
+		if not stream:
+			raise ValueError('ITM stimulus stream is empty')
+		if len(stream) > blocks * ebrBytes:
+			raise ValueError(
+				f'ITM stimulus stream is {len(stream)} bytes, which needs {-(-len(stream) // ebrBytes)} EBR blocks '
+				f'but only {blocks} are available ({blocks * ebrBytes} bytes)'
+			)
+		parser = ITMParser()
+		offsets = []
+		offset = 0
+		for packet in parser.feed(stream):
+			if packet.kind == ITMPacketKind.reserved:
+				raise ValueError(
+					f'ITM stimulus stream contains an invalid packet header 0x{packet.data[0]:02x} at offset {offset}'
+				)
+			offsets.append(offset)
+			offset += len(packet.data)
+		if offset != len(stream):
+			raise ValueError(f'ITM stimulus stream ends part way through a packet at offset {offset}')
+		return cls(bytes(stream), tuple(offsets))
+
+	@classmethod
+	def fromFile(cls, fileName: Path, cacheDir: Path | None = None) -> 'StimulusImage':
+		# Validating a large trace means walking every packet in it, so remember streams that have been checked
+		# before by their content along with where their packets start
+		stream = fileName.read_bytes()
+		if cacheDir is None:
+			return cls.fromStream(stream)
+		cacheFile = cacheDir / f'{blake2b(stream, digest_size = 32).hexdigest()}.json'
+		if cacheFile.is_file():
+			with cacheFile.open('r') as file:
+				return cls(stream, tuple(load(file)['packets']))
+		image = cls.fromStream(stream)
+		cacheDir.mkdir(parents = True, exist_ok = True)
+		partial = cacheFile.with_suffix('.partial')
+		with partial.open('w') as file:
+			dump({'packets': image.packets}, file)
+		partial.replace(cacheFile)
+		return image
+
+	@classmethod
+	def default(cls) -> 'StimulusImage':
+		return cls.fromStream(b''.join(itmStreamPackets()))
@@ -1,15 +1,20 @@
 # SPDX-License-Identifier: BSD-3-Clause
 # SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
 # SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
-from torii import Elaboratable, Module, Signal, Const, EnableInserter, Shape
+from torii import Elaboratable, Module, Signal, Const, EnableInserter, Shape, Mux
 from torii.build import Platform
-from enum import IntEnum, unique
+from enum import Enum, IntEnum, unique
 from .manchester import ManchesterEncoder
 from .itmStimulusROM import ITMStimulusROM
+from .stimulus import StimulusImage
+from .tpiu import TPIUFormatter
+from .berTester import BERTester, RegisterReadout
 from .button import Button
 
 __all__ = (
 	'SWO',
+	'SWOMode',
+	'Loopback',
 )
 
 @unique
@@ -17,7 +22,35 @@ class SWOMode(IntEnum):
 	triggered = 0
 	continuous = 1
 
+@unique
+class Loopback(Enum):
+	# Check the SWO output as it is driven onto the pin
+	internal = 'internal'
+	# Check the SWO output as it comes back in on the loopback pin, testing the whole I/O path
+	external = 'external'
+
 class SWO(Elaboratable):
+	def __init__(
+		self, stimulus: StimulusImage | None = None, baudRate: int = 115200, loopback: Loopback | None = None,
+		mode: SWOMode = SWOMode.triggered, tpiu: TPIUFormatter | None = None
+	) -> None:
+		# ITM packets to send, defaulting to the character stream described below
+		self.stimulus = stimulus if stimulus is not None else StimulusImage.default()
+		self.baudRate = baudRate
+		# Mode to come up in, which the button then switches between
+		self.mode = mode
+		# If given, a TPIU formatter whose output to send in place of the stimulus, a TPIU frame per SWO frame
+		self.tpiu = tpiu
+		if tpiu is not None and loopback is not None:
+			raise ValueError(
+				'The loopback BER tester checks against the stimulus ROM, so cannot be used with the TPIU formatter'
+			)
+		# If requested, a bit error rate tester that checks what we send
+		self.loopback = loopback
+		self.berTester = None
+		if loopback is not None:
+			self.berTester = BERTester(len(self.stimulus.data), baudRate)
+
 	def elaborate(self, platform: Platform) -> Module:
 		m = Module()
 		# Start by grabbing the SWO interface to use for I/O
@@ -32,13 +65,25 @@ class SWO(Elaboratable):
 		ledRun = platform.request('led', 0).o
 		ledState = platform.request('led', 1).o
 
-		# Small 64 entry ROM of ITM stimulus data that outputs 'A' through 'Z', 'a' through 'z'
+		# ROM of ITM stimulus data that by default outputs 'A' through 'Z', 'a' through 'z'
 		# and '0' through '9' followed by '\r' and '\n'. All entries are SWIT packets for 1 byte
-		# outputs on ITM stimulus port 0 (ITM stream 0)
-		m.submodules.dataROM = dataROM = ITMStimulusROM()
-		data = Signal.like(dataROM.data)
-		bit = Signal(range(17), reset = 0)
-		mode = Signal(SWOMode, reset = SWOMode.triggered)
+		# outputs on ITM stimulus port 0 (ITM stream 0). Each packet is sent as its own frame. Or, if there is
+		# a TPIU formatter to use, the formatter's 16 byte frames, interleaving several stimulus ROMs
+		if self.tpiu is None:
+			m.submodules.dataROM = source = dataROM = ITMStimulusROM(self.stimulus, checkPort = self.berTester is not None)
+		else:
+			m.submodules.formatter = source = self.tpiu
+		data = Signal.like(source.data)
+		bit = Signal(range(9), reset = 0)
+		mode = Signal(SWOMode, reset = self.mode)
+
+		# Internal signals for tracking where we are in the current packet
+		sourcePacket = Signal()
+		syncPacket = Signal()
+		bytesRemaining = Signal(range(5))
+		moreBytes = Signal()
+		# ROM entry of the start of the frame being sent
+		frameEntry = Signal(range(len(self.stimulus.data)))
 
 		# Internal signals for generating SWO in conjunction with the trigger pulses
 		trigger = Signal()
@@ -52,7 +97,7 @@ class SWO(Elaboratable):
 
 		# Instance the Manchester encoder block behind a clock gate so we can halt it on each rising edge
 		# on the output SWO signal for triggered mode
-		encoder: ManchesterEncoder = EnableInserter({'sync': encoderEnable})(ManchesterEncoder())
+		encoder: ManchesterEncoder = EnableInserter({'sync': encoderEnable})(ManchesterEncoder(self.baudRate))
 		m.submodules.encoder = encoder
 
 		# Delay the output a cycle
@@ -75,28 +120,62 @@ class SWO(Elaboratable):
 				with m.If(trigger | (mode == SWOMode.continuous)):
 					m.next = 'START'
 			with m.State('START'):
-				m.d.comb += encoder.start.eq(1)
-				m.d.sync += [
-					# Grab the next ITM entry to send out
-					data.eq(dataROM.data),
-					# And step to the next entry in the ROM for the next time through
-					dataROM.entry.eq(dataROM.entry + 1),
+				header = source.data
+				m.d.comb += [
+					encoder.start.eq(1),
+					# Step to the next byte in the ROM for the next time through
+					source.advance.eq(1),
 				]
+				m.d.sync += data.eq(header)
+				if self.tpiu is None:
+					m.d.sync += [
+						# Grab the header of the next ITM packet to send out
+						frameEntry.eq(dataROM.entry),
+						# Source packets have a payload of 1, 2 or 4 bytes given by the bottom 2 bits of the header
+						sourcePacket.eq(header[0:2] != 0),
+						bytesRemaining.eq(Mux(header[0:2] == 3, 4, header[0:2])),
+						# Synchronisation packets are a run of 0 bytes ended by 0x80
+						syncPacket.eq(header == 0),
+						# And all other packets carry on for as long as bit 7 of the last byte is set
+						moreBytes.eq((header[0:2] != 0) | (header == 0) | header[7]),
+					]
+				else:
+					# The formatter tells us where its frames end
+					m.d.sync += moreBytes.eq(~source.last)
 				m.next = 'TRANSMIT'
 			with m.State('TRANSMIT'):
 				# When the previous bit completes
 				with m.If(cycleComplete):
 					# Queue the next, if there are more to go
-					with m.If(bit != 16):
+					with m.If(bit != 8):
 						m.d.comb += encoder.bitIn.eq(data[0])
-						m.d.sync += [
-							bit.eq(bit + 1),
-							data.eq(data.shift_right(1)),
-						]
+						# If that was the last bit of this byte and there are more in the packet, grab the next
+						with m.If((bit == 7) & moreBytes):
+							nextByte = source.data
+							m.d.comb += source.advance.eq(1)
+							m.d.sync += [
+								bit.eq(0),
+								data.eq(nextByte),
+								bytesRemaining.eq(bytesRemaining - 1),
+							]
+							if self.tpiu is None:
+								with m.If(sourcePacket):
+									m.d.sync += moreBytes.eq(bytesRemaining != 1)
+								with m.Elif(syncPacket):
+									m.d.sync += moreBytes.eq(nextByte == 0)
+								with m.Else():
+									m.d.sync += moreBytes.eq(nextByte[7])
+							else:
+								m.d.sync += moreBytes.eq(~source.last)
+						with m.Else():
+							m.d.sync += [
+								bit.eq(bit + 1),
+								data.eq(data.shift_right(1)),
+							]
 				# Use the non-delayed version for STOP generation
 				with m.Elif(encoder.cycleComplete):
 					# And we've output all the bits, do a stop bit
-					with m.If(bit == 16):
+					with m.If(bit == 8):
 						m.d.comb += encoder.stop.eq(1)
 						m.d.sync += bit.eq(0)
 						m.next = 'STOP'
@@ -182,4 +261,32 @@ class SWO(Elaboratable):
 			# And indicate when the SWO output is active using the red
 			ledRun.eq(running & encoderEnable)
 		]
+
+		if self.berTester is not None:
+			m.submodules.berTester = berTester = self.berTester
+			if self.loopback == Loopback.external:
+				lineIn = platform.request('loopback', 0).i
+			else:
+				lineIn = swo
+			m.d.comb += [
+				berTester.lineIn.eq(lineIn),
+				# Triggered mode stretches bits out arbitrarily, so only check in continuous mode
+				berTester.enable.eq(mode == SWOMode.continuous),
+				berTester.frameEntry.eq(frameEntry),
+				dataROM.checkEntry.eq(berTester.expectedEntry),
+				berTester.expectedData.eq(dataROM.checkData),
+			]
+
+			# Make the BER tester's counters readable over the UART
+			m.submodules.readout = readout = RegisterReadout(
+				(berTester.frames, berTester.bitsChecked, berTester.bitErrors, berTester.frameErrors),
+				divisor = int(platform.default_clk_frequency // 115200), pins = platform.request('uart', 0)
+			)
+			m.d.comb += berTester.clear.eq(readout.clear)
+
+			# Use the LEDs on the break-off section to show if we're locked to the stream and if there are errors
+			m.d.comb += [
+				platform.request('led', 2).o.eq(berTester.errors),
+				platform.request('led', 3).o.eq(berTester.locked & ~berTester.errors),
+			]
 		return m
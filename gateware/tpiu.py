@@ -0,0 +1,173 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from torii import Elaboratable, Module, Signal, Const, Array, Cat, Mux
+from torii.build import Platform
+from .itmStimulusROM import ITMStimulusROM
+from .stimulus import StimulusImage, ebrBlocks
+
+__all__ = (
+	'TPIUFormatter',
+	'frameBytes',
+	'frameSync',
+	'maxSourceID',
+)
+
+# Formatted trace goes out in 16 byte frames, with a full frame synchronisation packet (0x7fffffff) between them
+frameBytes = 16
+frameSync = bytes((0xff, 0xff, 0xff, 0x7f))
+# Trace source IDs 0x70 and up are reserved, and 0 marks null data
+maxSourceID = 0x6f
+
+class TPIUFormatter(Elaboratable):
+	'''
+	TPIU formatter, running in continuous mode.
+
+	Interleaves several ITM streams, each from a stimulus ROM of its own, into TPIU frames. Each source gets a
+	trace source ID, starting from 1 for the first, and the sources take it in turns to send `switchInterval`
+	bytes each. A full frame synchronisation packet goes out at the start and then after every `syncInterval`
+	frames, or never after the start if that is 0.
+
+	Bytes are pulled out a byte at a time the same as from the stimulus ROM: `data` is the next byte to send,
+	`last` says if it is the last of a frame or synchronisation packet, and pulsing `advance` steps on to the
+	next. The ROMs take a cycle to read, so `advance` must not be pulsed on two cycles running.
+	'''
+
+	def __init__(self, sources: tuple[StimulusImage, ...], switchInterval: int = 16, syncInterval: int = 8) -> None:
+		if not sources:
+			raise ValueError('The TPIU formatter needs at least one stimulus source')
+		if len(sources) > maxSourceID:
+			raise ValueError(f'The TPIU formatter can interleave at most {maxSourceID} sources, not {len(sources)}')
+		blocks = sum(image.blocks for image in sources)
+		if blocks > ebrBlocks:
+			raise ValueError(
+				f'The TPIU formatter stimulus sources need {blocks} EBR blocks but only {ebrBlocks} are available'
+			)
+		if switchInterval < 1:
+			raise ValueError(f'Sources must each send at least 1 byte before switching, not {switchInterval}')
+		if syncInterval < 0:
+			raise ValueError(f'Synchronisation interval must be 0 or more frames, not {syncInterval}')
+
+		self.sources = tuple(sources)
+		self.switchInterval = switchInterval
+		self.syncInterval = syncInterval
+
+		self.data = Signal(8)
+		self.last = Signal()
+		self.advance = Signal()
+
+	def elaborate(self, platform: Platform) -> Module:
+		m = Module()
+
+		roms: list[ITMStimulusROM] = []
+		for index, image in enumerate(self.sources):
+			rom = ITMStimulusROM(image)
+			m.submodules[f'source{index}'] = rom
+			roms.append(rom)
+		sourceData = Array(rom.data for rom in roms)
+
+		# Start off as if the last source had just finished its turn, so the first frame opens with the first's ID
+		source = Signal(range(len(roms)), reset = len(roms) - 1)
+		nextSource = Signal.like(source)
+		sent = Signal(range(self.switchInterval + 1), reset = self.switchInterval)
+		# Set when an ID change has gone out which only applies after the data byte following it
+		switchPending = Signal()
+		m.d.comb += nextSource.eq(Mux(source == len(roms) - 1, 0, source + 1))
+
+		# Each frame is 8 pairs of bytes. The first of a pair is either an ID change, with bit 0 set and the ID in
+		# bits 1-7, or data with bit 0 cleared and the real bit 0 moved to bit n of the last byte of the frame for
+		# pair n. For an ID change, that bit instead says if the ID applies only after the data byte that follows.
+		# The second of a pair is always data, apart from in the last pair where it is the byte of moved bits
+		byte = Signal(range(frameBytes))
+		pair = byte[1:4]
+		auxiliary = Signal(8)
+		frames = Signal(range(max(self.syncInterval, 1)))
+		syncing = Signal(reset = 1)
+		syncByte = Signal(range(len(frameSync)))
+
+		streamData = sourceData[source]
+		nextID = Cat(Const(1, 1), (nextSource + 1)[0:7])
+		# Data bytes consumed from the current source
+		sendingData = Signal()
+
+		with m.If(syncing):
+			m.d.comb += [
+				self.data.eq(Mux(syncByte == len(frameSync) - 1, frameSync[-1], 0xff)),
+				self.last.eq(syncByte == len(frameSync) - 1),
+			]
+			with m.If(self.advance):
+				m.d.sync += syncByte.eq(syncByte + 1)
+				with m.If(syncByte == len(frameSync) - 1):
+					m.d.sync += [
+						syncByte.eq(0),
+						syncing.eq(0),
+					]
+		with m.Elif(byte == frameBytes - 1):
+			m.d.comb += [
+				self.data.eq(auxiliary),
+				self.last.eq(1),
+			]
+			with m.If(self.advance):
+				m.d.sync += [
+					byte.eq(0),
+					auxiliary.eq(0),
+				]
+				if self.syncInterval:
+					with m.If(frames == self.syncInterval - 1):
+						m.d.sync += [
+							frames.eq(0),
+							syncing.eq(1),
+						]
+					with m.Else():
+						m.d.sync += frames.eq(frames + 1)
+		with m.Elif(byte[0]):
+			m.d.comb += [
+				self.data.eq(streamData),
+				sendingData.eq(self.advance),
+			]
+			with m.If(self.advance):
+				m.d.sync += byte.eq(byte + 1)
+		# Even bytes: if the current source has had its turn, switch to the next right away
+		with m.Elif(sent == self.switchInterval):
+			m.d.comb += self.data.eq(nextID)
+			with m.If(self.advance):
+				m.d.sync += [
+					byte.eq(byte + 1),
+					source.eq(nextSource),
+					sent.eq(0),
+				]
+		# If it has one byte left, switch after sending that as the odd byte, unless that would be the byte of
+		# moved bits, in which case the byte is sent here and the switch made at the start of the next frame
+		with m.Elif((sent == self.switchInterval - 1) & (byte != frameBytes - 2)):
+			m.d.comb += self.data.eq(nextID)
+			with m.If(self.advance):
+				m.d.sync += [
+					byte.eq(byte + 1),
+					auxiliary.eq(auxiliary | (Const(1, 8) << pair)),
+					switchPending.eq(1),
+				]
+		with m.Else():
+			m.d.comb += [
+				self.data.eq(Cat(Const(0, 1), streamData[1:8])),
+				sendingData.eq(self.advance),
+			]
+			with m.If(self.advance):
+				m.d.sync += [
+					byte.eq(byte + 1),
+					auxiliary.eq(auxiliary | (streamData[0] << pair)),
+				]
+
+		# Step the current source on as each of its bytes is sent, and keep track of how much of its turn is left
+		for index, rom in enumerate(roms):
+			m.d.comb += rom.advance.eq(sendingData & (source == index))
+		with m.If(sendingData):
+			with m.If(switchPending):
+				m.d.sync += [
+					source.eq(nextSource),
+					sent.eq(0),
+					switchPending.eq(0),
+				]
+			with m.Else():
+				m.d.sync += sent.eq(sent + 1)
+
+		return m
@@ -0,0 +1,301 @@
+# SPDX-License-Identifier: BSD-3-Clause
+# SPDX-FileCopyrightText: 2023 1BitSquared <info@1bitsquared.com>
+# SPDX-FileContributor: Written by Rachel Mant <git@dragonmux.network>
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+import re
+
+__all__ = (
+	'VCDFile',
+	'VCDSignal',
+	'VCDDivergence',
+	'diffVCDs',
+)
+
+# Map of VCD timescale units to their multiplier to get to femtoseconds
+timescaleUnits = {
+	b's': 10 ** 15,
+	b'ms': 10 ** 12,
+	b'us': 10 ** 9,
+	b'ns': 10 ** 6,
+	b'ps': 10 ** 3,
+	b'fs': 1,
+}
+
+@dataclass(frozen = True)
+class VCDSignal:
+	# Full dotted hierarchical name of the signal, eg 'bench.top.encoder.manchesterOut'
+	name: str
+	# VCD identifier code the value changes for this signal are recorded against
+	code: bytes
+	width: int
+	kind: str
+
+	@property
+	def aliasName(self) -> str:
+		# Torii flattens Record fields into `record__field` names, turn those back into dotted form
+		return self.name.replace('__', '.')
+
+@dataclass(frozen = True)
+class VCDDivergence:
+	signal: str
+	time: int
+	cycle: int
+	golden: str
+	current: str
+
+class _ChangeIndex:
+	def __init__(self) -> None:
+		# Timestamp of each value change, and the file offset of the line describing the new value
+		self.times = array('Q')
+		self.offsets = array('Q')
+
+class VCDFile:
+	'''
+	Memory-mapped VCD reader.
+
+	Only the header is parsed on construction. Value changes stay in the file and are located by
+	building a per-signal change index (the time and file offset of every change) in a single pass
+	over the mapping the first time a signal is asked about. Values are only decoded on demand, so
+	dumps of many hundreds of MiB can be queried without being read into memory.
+	'''
+
+	def __init__(self, fileName: Path | str) -> None:
+		self.fileName = Path(fileName)
+		self._file = self.fileName.open('rb')
+		try:
+			self._map = mmap(self._file.fileno(), 0, access = ACCESS_READ)
+		except ValueError:
+			self._file.close()
+			raise ValueError(f'VCD file {self.fileName} is empty')
+		self.signals: dict[str, VCDSignal] = {}
+		self.timescale = 1
+		self._index: dict[bytes, _ChangeIndex] = {}
+		self._risingEdges: array | None = None
+		self._parseHeader()
+
+	def __enter__(self) -> 'VCDFile':
+		return self
+
+	def __exit__(self, *_) -> None:
+		self.close()
+
+	def close(self) -> None:
+		self._map.close()
+		self._file.close()
+
+	def _parseHeader(self) -> None:
+		endDefinitions = self._map.find(b'$enddefinitions')
+		if endDefinitions == -1:
+			raise ValueError(f'VCD file {self.fileName} has no $enddefinitions section')
+		endDefinitions = self._map.find(b'$end', endDefinitions + len(b'$enddefinitions'))
+		if endDefinitions == -1:
+			raise ValueError(f'VCD file {self.fileName} has an unterminated $enddefinitions section')
+		# Value changes begin immediately after the header
+		self._dataStart = endDefinitions + len(b'$end')
+
+		tokens = iter(self._map[:endDefinitions].split())
+		scopes: list[str] = []
+		for token in tokens:
+			if token == b'$scope':
+				# `$scope <type> <name> $end`
+				next(tokens)
+				scopes.append(next(tokens).decode())
+			elif token == b'$upscope':
+				scopes.pop()
+			elif token == b'$var':
+				# `$var <kind> <width> <code> <name> [range] $end`
+				kind = next(tokens).decode()
+				width = int(next(tokens))
+				code = next(tokens)
+				name = next(tokens).decode()
+				signal = VCDSignal('.'.join((*scopes, name)), code, width, kind)
+				self.signals[signal.name] = signal
+			elif token == b'$timescale':
+				timescale = b''
+				for token in tokens:
+					if token == b'$end':
+						break
+					timescale += token
+				self.timescale = self._parseTimescale(timescale)
+				continue
+			else:
+				continue
+			# Skip to the end of the declaration
+			for token in tokens:
+				if token == b'$end':
+					break
+
+	def _parseTimescale(self, timescale: bytes) -> int:
+		match = re.fullmatch(rb'(\d+)([a-z]+)', timescale)
+		if match is None or match[2] not in timescaleUnits:
+			raise ValueError(f'VCD file {self.fileName} has an invalid timescale \'{timescale.decode()}\'')
+		return int(match[1]) * timescaleUnits[match[2]]
+
+	# Time of the last timestamp in the dump, which is when the simulation stopped. Only the last line starting with a
+	# '#' is looked at, so this doesn't have to search through the whole of a large dump
+	@property
+	def endTime(self) -> int:
+		start = self._map.rfind(b'\n#', self._dataStart)
+		if start != -1:
+			# A timestamp is at most 20 digits long, as it's a 64-bit number
+			match = re.match(rb'#(\d+)', self._map[start + 1:start + 22])
+			if match is not None:
+				return int(match[1])
+		# Without a timestamp line to go on, use the latest change found while indexing
+		times = [changes.times[-1] for changes in self._index.values() if changes.times]
+		if not times:
+			raise ValueError(f'VCD file {self.fileName} contains no timestamps')
+		return max(times)
+
+	# Find a signal by name. Besides the full hierarchical name, this accepts any trailing part of the name
+	# with Record fields written in dotted form, so `swo.o` finds `bench.top.swo__swo__o` and
+	# `encoder.manchesterOut` finds `bench.top.encoder.manchesterOut`
+	def lookup(self, name: str) -> VCDSignal:
+		signal = self.signals.get(name)
+		if signal is not None:
+			return signal
+
+		candidates = [
+			signal for signal in self.signals.values()
+			if signal.aliasName == name or signal.aliasName.endswith(f'.{name}')
+		]
+		# The same signal may appear in several scopes, which is fine as long as they all share one code
+		if len({signal.code for signal in candidates}) > 1:
+			names = ', '.join(signal.name for signal in candidates)
+			raise ValueError(f'Signal name \'{name}\' is ambiguous in {self.fileName}, could be any of {names}')
+		if not candidates:
+			raise KeyError(f'Signal \'{name}\' not found in {self.fileName}')
+		# Prefer the shallowest of the equivalent names
+		return min(candidates, key = lambda signal: signal.name.count('.'))
+
+	def __contains__(self, name: str) -> bool:
+		try:
+			self.lookup(name)
+			return True
+		except KeyError:
+			return False
+		# An ambiguous name matches several signals in the file, so is there - it just needs qualifying to use
+		except ValueError:
+			return True
+
+	# Build the change index for the requested signals in a single pass over the file
+	def index(self, *names: str) -> None:
+		codes = {self.lookup(name).code for name in names} - self._index.keys()
+		if not codes:
+			return
+
+		indices = {code: _ChangeIndex() for code in codes}
+		# Match timestamps along with scalar and vector changes to just the signals we care about, letting the
+		# regex engine do the work of skipping everything else
+		identifiers = b'|'.join(re.escape(code) for code in sorted(codes, key = len, reverse = True))
+		pattern = re.compile(
+			rb'^#(\d+)|^(?:[01xzXZ]|[bBrRs]\S+ )(' + identifiers + rb')\r?$',
+			re.MULTILINE
+		)
+
+		time = 0
+		for match in pattern.finditer(self._map, self._dataStart):
+			# Group 1 is the last to match for timestamps, group 2 for value changes
+			if match.lastindex == 1:
+				time = int(match[1])
+			else:
+				changes = indices[match[2]]
+				changes.times.append(time)
+				changes.offsets.append(match.start())
+		self._index.update(indices)
+
+	def _changes(self, signal: VCDSignal) -> _ChangeIndex:
+		if signal.code not in self._index:
+			self.index(signal.name)
+		return self._index[signal.code]
+
+	def _decode(self, offset: int) -> str:
+		kind = self._map[offset:offset + 1]
+		# Scalar change, value is the first character
+		if kind not in b'bBrRs':
+			return kind.decode().lower()
+		end = self._map.find(b'\n', offset)
+		line = self._map[offset:end if end != -1 else len(self._map)].rstrip()
+		value = line[1:line.rindex(b' ')].decode()
+		if kind in b'bB':
+			# Normalise away any leading 0's so differently compressed dumps still compare equal
+			return value.lower().lstrip('0') or '0'
+		return value
+
+	# Yield (time, value) for every change to the named signal in the time range [start, end)
+	def changes(self, name: str, start: int = 0, end: int | None = None):
+		changes = self._changes(self.lookup(name))
+		begin = bisect_left(changes.times, start)
+		finish = len(changes.times) if end is None else bisect_left(changes.times, end)
+		for entry in range(begin, finish):
+			yield changes.times[entry], self._decode(changes.offsets[entry])
+
+	# Get the times and raw value characters of every change to a 1-bit signal in one go, for bulk processing
+	def scalarChanges(self, name: str) -> tuple[array, bytes]:
+		signal = self.lookup(name)
+		if signal.width != 1:
+			raise ValueError(f'Signal \'{name}\' is {signal.width} bits wide, not a scalar')
+		changes = self._changes(signal)
+		return changes.times, bytes(self._map[offset] for offset in changes.offsets)
+
+	# Get the value of the named signal at the given time, after all changes at that time are applied
+	def valueAt(self, name: str, time: int) -> str | None:
+		changes = self._changes(self.lookup(name))
+		entry = bisect_right(changes.times, time)
+		if entry == 0:
+			return None
+		return self._decode(changes.offsets[entry - 1])
+
+	def _clockEdges(self) -> array:
+		if self._risingEdges is None:
+			changes = self._changes(self.lookup('clk'))
+			# The clock is a scalar so the value is just the byte at the start of each change
+			self._risingEdges = array('Q', (
+				time for time, offset in zip(changes.times, changes.offsets) if self._map[offset] == ord('1')
+			))
+		return self._risingEdges
+
+	# Convert a time into the number of rising `clk` edges that happened before it
+	def cycleAt(self, time: int) -> int:
+		return bisect_left(self._clockEdges(), time)
+
+def _firstDivergence(golden: VCDFile, current: VCDFile, signal: str) -> VCDDivergence | None:
+	goldenChanges = golden._changes(golden.lookup(signal))
+	currentChanges = current._changes(current.lookup(signal))
+	goldenTimes = goldenChanges.times
+	currentTimes = currentChanges.times
+	goldenEntry = 0
+	currentEntry = 0
+	goldenValue = None
+	currentValue = None
+
+	# Walk both change lists in time order, only decoding values when something actually changed
+	while goldenEntry < len(goldenTimes) or currentEntry < len(currentTimes):
+		time = min(
+			goldenTimes[goldenEntry] if goldenEntry < len(goldenTimes) else 2 ** 64,
+			currentTimes[currentEntry] if currentEntry < len(currentTimes) else 2 ** 64,
+		)
+		# Skip to the final change in each list at this time, which is the settled value
+		if goldenEntry < len(goldenTimes) and goldenTimes[goldenEntry] == time:
+			goldenEntry = bisect_right(goldenTimes, time, goldenEntry)
+			goldenValue = golden._decode(goldenChanges.offsets[goldenEntry - 1])
+		if currentEntry < len(currentTimes) and currentTimes[currentEntry] == time:
+			currentEntry = bisect_right(currentTimes, time, currentEntry)
+			currentValue = current._decode(currentChanges.offsets[currentEntry - 1])
+
+		if goldenValue != currentValue:
+			return VCDDivergence(signal, time, golden.cycleAt(time), str(goldenValue), str(currentValue))
+	return None
+
+# Compare the requested signals between two VCDs, returning the first divergence for each
+def diffVCDs(golden: VCDFile, current: VCDFile, signals: list[str]) -> dict[str, VCDDivergence | None]:
+	if golden.timescale != current.timescale:
+		raise ValueError(f'VCD timescales do not match between {golden.fileName} and {current.fileName}')
+	# Build the indices for everything being compared in one pass per file
+	golden.index('clk', *signals)
+	current.index(*signals)
+	return {signal: _firstDivergence(golden, current, signal) for signal in signals}